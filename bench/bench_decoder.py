@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Compare the 'mixed' error handler with the one it replaced,
+which kept the last error position in a global.
+
+Decodes the fixture pages as utf-8, as mixed pages with every
+other line in ISO-8859-1 and as pure ISO-8859-1, and a long
+Icelandic text in ISO-8859-1 and mixed by line, first serially
+and then from several threads at once, counting pages decoded
+wrong (or not at all).
+
+usage: python bench/bench_decoder.py [repeat] [threads]
+"""
+
+import sys
+import codecs
+import threading
+
+from common import read_index, read_fixture, timed
+from tolvutek.decoding import decode_mixed
+
+last_pos = -1
+def legacy_decoder(unicode_error):
+    global last_pos
+    string = unicode_error[1]
+    pos = unicode_error.start
+    if pos <= last_pos:
+        pos = last_pos+1
+    last_pos = pos
+    new_char = string[pos].decode('ISO-8859-1')
+    return new_char, pos+1
+
+codecs.register_error('legacy_mixed', legacy_decoder)
+
+def decode_legacy(data):
+    #reset as in a fresh process, otherwise every page after
+    #the first one is decoded from the previous page's position
+    global last_pos
+    last_pos = -1
+    return data.decode('utf-8', 'legacy_mixed')
+
+DECODERS = [('legacy', decode_legacy), ('mixed', decode_mixed)]
+
+def latin1(text):
+    return text.encode('ISO-8859-1', 'xmlcharrefreplace')
+
+def mix(text):
+    lines = text.splitlines(True)
+    return ''.join(
+        latin1(line) if i%2 else line.encode('utf-8')
+        for i, line in enumerate(lines)
+        )
+
+#dense in non ascii letters, unlike the fixture pages
+PROSE = (
+    u'Ver\xf0 \xe1 t\xf6lvum og \xedhlutum \xed verslun okkar '
+    u'\xed Reykjav\xedk og \xe1 Akureyri. \xdeessi v\xf6ru\xfeing '
+    u'er me\xf0 \xferiggja \xe1ra \xe1byrg\xf0 og fr\xedu '
+    u'\xfatkeyrslu \xe1 h\xf6fu\xf0borgarsv\xe6\xf0inu.\n'
+    )*5000
+
+def page_sets():
+    """
+    Get [(name, [(bytes, expected text)])].
+    """
+    texts = [
+        read_fixture(name).decode('utf-8')
+        for name in sorted(set(read_index().values()))
+        ]
+    return [
+        ('utf-8', [(t.encode('utf-8'), t) for t in texts]),
+        ('mixed', [(mix(t), latin1(t).decode('ISO-8859-1')) for t in texts]),
+        ('latin-1', [(latin1(t), latin1(t).decode('ISO-8859-1')) for t in texts]),
+        ('prose-l1', [(latin1(PROSE), PROSE)]),
+        ('prose-mx', [(mix(PROSE), PROSE)]),
+        ]
+
+def wrong(decode, pages):
+    n = 0
+    for data, text in pages:
+        try:
+            if decode(data) != text:
+                n += 1
+        except IndexError:
+            #the legacy handler can step past the end of the page
+            n += 1
+    return n
+
+def decode_all(decode, pages):
+    for data, text in pages:
+        try:
+            decode(data)
+        except IndexError:
+            pass
+
+def wrong_threaded(decode, pages, threads):
+    errors = [0]
+    lock = threading.Lock()
+    def work():
+        n = wrong(decode, pages)
+        with lock:
+            errors[0] += n
+    workers = [threading.Thread(target=work) for i in xrange(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return errors[0]
+
+def main(repeat=20, threads=4):
+    print '{:<8} {:<8} {:>10} {:>10} {:>8} {:>10}'.format(
+        'pages', 'decoder', 'mean ms', 'min ms', 'wrong', 'threaded'
+        )
+    for setname, pages in page_sets():
+        for name, decode in DECODERS:
+            wrong_serial = wrong(decode, pages)
+            times = timed(lambda: decode_all(decode, pages), repeat)
+            print '{:<8} {:<8} {:>10.2f} {:>10.2f} {:>8} {:>10}'.format(
+                setname, name, 1000*sum(times)/len(times), 1000*min(times),
+                '{}/{}'.format(wrong_serial, len(pages)),
+                '{}/{}'.format(
+                    wrong_threaded(decode, pages, threads), threads*len(pages)
+                    )
+                )
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
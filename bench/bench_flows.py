@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Benchmark the scraping flows against the local stand-in server.
+Each benchmark runs in its own process so peak memory is its own.
+Every run starts from a fresh `Tolvutek`, so nothing is cached.
+
+usage: python bench/bench_flows.py [-n REPEAT] [-l LATENCY] [names]
+"""
+
+import argparse
+import resource
+import multiprocessing
+
+from common import LISTING, server_api, percentile, timed
+from server import FixtureServer
+from builder import Builder
+
+def bench_categories(api):
+    api.get_categories()
+
+def bench_products_quick(api):
+    api.get_products(*LISTING)
+
+def bench_products_full(api):
+    api.get_products(*LISTING, quick=False)
+
+def bench_product(api):
+    api.get_product('/vara/tolvuihlutir-orgjorvar-lga1150-0')
+
+def bench_search(api):
+    api.search('intel')
+
+def bench_builder(api):
+    builder = Builder(None, None, api=api)
+    socket = 'lga1150'
+    assert socket in builder.get_sockets()
+    build = builder.build
+    build['cpu'] = builder.get_cpus(socket)[0]
+    build['motherboard'] = builder.get_motherboards(socket)[0]
+    ramtype = builder.get_mobo_ram_type(build['motherboard'])
+    build['ram'] = builder.get_rams(ramtype, '8')[0]
+    build['storage'] = builder.get_drives('SSD', '120GB')[0]
+    builder._build_to_text()
+
+BENCHMARKS = [
+    ('categories', bench_categories),
+    ('products_quick', bench_products_quick),
+    ('products_full', bench_products_full),
+    ('product', bench_product),
+    ('search', bench_search),
+    ('builder', bench_builder),
+    ]
+
+def run(func, url, repeat, results):
+    def once():
+        func(server_api(url))
+    once() #warm up imports and code paths
+    times = timed(once, repeat)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((times, peak))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-n', '--repeat', type=int, default=20)
+    parser.add_argument('-l', '--latency', type=float, default=0.0,
+                        help='seconds the server delays each response')
+    parser.add_argument('names', nargs='*', help='benchmarks to run')
+    args = parser.parse_args()
+    server = FixtureServer(latency=args.latency).start()
+
+    print '{:<16} {:>9} {:>9} {:>9} {:>11}'.format(
+        'benchmark', 'ops/s', 'p50 ms', 'p99 ms', 'peak rss kb'
+        )
+    for name, func in BENCHMARKS:
+        if args.names and name not in args.names:
+            continue
+        results = multiprocessing.Queue()
+        proc = multiprocessing.Process(
+            target=run, args=(func, server.url, args.repeat, results)
+            )
+        proc.start()
+        times, peak = results.get()
+        proc.join()
+        print '{:<16} {:>9.1f} {:>9.1f} {:>9.1f} {:>11}'.format(
+            name, len(times)/sum(times),
+            1000*percentile(times, 50), 1000*percentile(times, 99), peak
+            )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Compare parser engines on the fixture pages.
+Every engine must produce the same products as the default one.
+
+usage: python bench/bench_parser.py [repeat]
+"""
+
+import sys
+
+from bs4 import FeatureNotFound
+
+from common import LISTING, fixture_api, product_fields, timed
+
+ENGINES = [
+    ('default', {}),
+    ('html.parser', {'parser':'html.parser'}),
+    ('lxml', {'parser':'lxml'}),
+    ('html.parser+strain', {'parser':'html.parser', 'strain':True}),
+    ('lxml+strain', {'parser':'lxml', 'strain':True}),
+    ]
+
+def scrape(api):
+    api.soup_cache.clear()
+    api.products.clear()
+    return api.get_products(*LISTING, quick=False)
+
+def main(repeat=20):
+    expected = None
+    print '{:<20} {:>10} {:>10}'.format('engine', 'mean ms', 'min ms')
+    for name, kwargs in ENGINES:
+        api = fixture_api(workers=1, **kwargs)
+        try:
+            #the parser is only looked up when the first page is parsed
+            result = [product_fields(p) for p in scrape(api)]
+        except FeatureNotFound:
+            print '{:<20} {:>10}'.format(name, 'n/a')
+            continue
+        if expected is None:
+            expected = result
+        elif result != expected:
+            raise AssertionError('{} gives different products'.format(name))
+        times = timed(lambda: scrape(api), repeat)
+        print '{:<20} {:>10.1f} {:>10.1f}'.format(
+            name, 1000*sum(times)/len(times), 1000*min(times)
+            )
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Shared helpers for the benchmarks.
+"""
+
+import os
+import sys
+import json
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'bench', 'fixtures')
+sys.path.insert(0, ROOT)
+
+from tolvutek import Tolvutek
+from tolvutek.cache import BaseCache, CacheEntry
+
+#the category the listing fixtures stand in for
+LISTING = ('tolvuihlutir', 'orgjorvar', 'lga1150')
+
+def read_index():
+    """
+    Get the fixture index {'/relative/url':'filename'}.
+    """
+    f = open(os.path.join(FIXTURES, 'index.json'))
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def read_fixture(name):
+    f = open(os.path.join(FIXTURES, name), 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+class FixtureCache(BaseCache):
+    """
+    Read only page cache serving the fixture pages.
+    """
+    def __init__(self, url_base=Tolvutek.url_base):
+        super(FixtureCache, self).__init__()
+        self.url_base = url_base
+        self.pages = {}
+        for url, name in read_index().iteritems():
+            self.pages[self._key(url_base+url)] = read_fixture(name)
+
+    def _key(self, url):
+        url = url[len(self.url_base):]
+        return url if url not in ('', '/') else '/'
+
+    def cacheable(self, url):
+        return True
+
+    def get(self, url):
+        try:
+            return CacheEntry(self.pages[self._key(url)])
+        except KeyError:
+            return None
+
+    def set(self, url, entry):
+        pass
+
+    def touch(self, url):
+        pass
+
+def fixture_api(**kwargs):
+    """
+    Get an offline `Tolvutek` reading pages from the fixtures.
+    """
+    return Tolvutek(cache=FixtureCache(), offline=True, **kwargs)
+
+def server_api(url, **kwargs):
+    """
+    Get a `Tolvutek` talking to the stand-in server at `url`.
+    """
+    api = Tolvutek(**kwargs)
+    api.url_base = url
+    return api
+
+def product_fields(product):
+    """
+    Get comparable field values of a `Product`.
+    """
+    return sorted(product.as_dict().iteritems())
+
+def percentile(times, p):
+    """
+    Get the `p`th percentile of a list of durations.
+    """
+    times = sorted(times)
+    return times[min(len(times)-1, int(round(p/100.0*(len(times)-1))))]
+
+def timed(func, repeat):
+    """
+    Call `func` `repeat` times and get a list of durations in seconds.
+    """
+    times = []
+    for i in xrange(repeat):
+        start = time.time()
+        func()
+        times.append(time.time()-start)
+    return times
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Record pages from the live site into the fixtures, replacing the
+synthetic page for each url with a real capture. Urls are relative,
+e.g. /karfa.
+Raw bytes are saved so the decoding is benchmarked too.
+
+usage: python bench/record.py URL [URL ...]
+"""
+
+import os
+import sys
+import json
+import hashlib
+
+from common import FIXTURES, read_index
+from tolvutek import Tolvutek
+
+def record(api, url, index):
+    name = index.get(url)
+    if not name:
+        name = 'recorded-{}.html'.format(hashlib.sha1(url).hexdigest()[:10])
+    if url == Tolvutek.url_cart:
+        api.login()
+    html = api.session.open(api.get_url(url)).read()
+    f = open(os.path.join(FIXTURES, name), 'wb')
+    try:
+        f.write(html)
+    finally:
+        f.close()
+    index[url] = name
+    print '{} -> {} ({} bytes)'.format(url, name, len(html))
+
+def main(urls):
+    if not urls:
+        print __doc__.strip()
+        return
+    api = Tolvutek()
+    index = read_index()
+    for url in urls:
+        record(api, url, index)
+    f = open(os.path.join(FIXTURES, 'index.json'), 'w')
+    try:
+        json.dump(index, f, indent=1, sort_keys=True)
+    finally:
+        f.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
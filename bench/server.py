@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Local stand-in for tolvutek.is serving the fixture pages.
+
+usage: python bench/server.py [-p PORT] [-l LATENCY]
+"""
+
+import gzip
+import time
+import argparse
+import threading
+import SocketServer
+import BaseHTTPServer
+from StringIO import StringIO
+
+from common import read_index, read_fixture
+from tolvutek import Tolvutek
+
+class FixtureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    #send each response in one go, Nagle would stall kept alive connections
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        path = self.path if self.path not in ('', '/') else '/'
+        try:
+            body = self.server.pages[path]
+        except KeyError:
+            return self.respond(404, 'Not found: {}'.format(path))
+        self.respond(200, body)
+
+    def do_POST(self):
+        time.sleep(self.server.latency)
+        self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        if self.path == Tolvutek.url_login:
+            return self.respond(302, '', {
+                'Location':'/',
+                'Set-Cookie':'PHPSESSID=fixture; path=/'
+                })
+        elif self.path == Tolvutek.url_add_to_cart:
+            return self.respond(200, '')
+        self.respond(404, 'Not found: {}'.format(self.path))
+
+    def respond(self, code, body, headers=None):
+        accept = self.headers.getheader('Accept-Encoding', '')
+        self.send_response(code)
+        if body and 'gzip' in accept:
+            buf = StringIO()
+            f = gzip.GzipFile(fileobj=buf, mode='wb')
+            f.write(body)
+            f.close()
+            body = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        for key, value in (headers or {}).iteritems():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class FixtureServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves the fixture pages with `latency` seconds delay per request.
+    Port 0 picks a free port, see `url`.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, ('127.0.0.1', port), FixtureHandler
+            )
+        self.latency = latency
+        self.pages = dict(
+            (url, read_fixture(name)) for url, name in read_index().iteritems()
+            )
+
+    def handle_error(self, request, client_address):
+        #benchmark clients drop their kept alive connections on exit
+        pass
+
+    @property
+    def url(self):
+        return u'http://{}:{}'.format(*self.server_address)
+
+    def start(self):
+        """
+        Serve in a background thread.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    parser.add_argument('-l', '--latency', type=float, default=0.0,
+                        help='seconds to delay each response')
+    args = parser.parse_args()
+    server = FixtureServer(args.port, args.latency)
+    print 'Serving fixtures on {}'.format(server.url)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
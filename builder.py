@@ -19,9 +19,15 @@ import getpass
 import logging
 import re
 import os
+import json
+import time
 import shelve
+import threading
+from multiprocessing.pool import ThreadPool
 
-from tolvutek import Tolvutek, TolvutekError
+from tolvutek import Tolvutek, TolvutekError, Product
+from tolvutek.cache import DAY
+from tolvutek.specs import parse_capacity
 
 log = logging.getLogger('tolvutek')
 
@@ -46,12 +52,29 @@ class BuildItem(object):
 
 
 class Builder(object):
+
+    drive_paths = {
+        'HDD':('tolvuihlutir', 'hardir-diskar-35', 'sata3'),
+        'SSD':('tolvuihlutir', 'ssd-diskar', 'sata3'),
+        }
     
-    def __init__(self, ttuser, ttpassword, bdir=None):
-        self.api = Tolvutek(username=ttuser, password=ttpassword)
+    def __init__(self, ttuser, ttpassword, bdir=None, api=None, workers=4):
+        """
+        Product listings are loaded in a pool of `workers` threads 
+        and kept for the life of the builder, see `prefetch`.
+        """
+        if api is None:
+            api = Tolvutek(username=ttuser, password=ttpassword)
+        self.api = api
         self.build = {}
+        self.workers = workers
+        self.pool = None
+        self.loaded = {} #(cat, subcat, subsubcat):AsyncResult of products
+        self._lock = threading.Lock()
         if bdir and os.path.isdir(bdir):
-            if os.path.exists(os.path.join(bdir, 'build.shelf')):
+            if os.path.exists(os.path.join(bdir, 'build.json')):
+                self.read_build(os.path.join(bdir, 'build.json'))
+            elif os.path.exists(os.path.join(bdir, 'build.shelf')):
                 self.read_shelf(os.path.join(bdir, 'build.shelf'))
         self.builddir = bdir
 
@@ -61,11 +84,49 @@ class Builder(object):
             self.build[key] = self.api.get_product(value)
         s.close()
 
+    def read_build(self, path):
+        """
+        Restore the build from a build file written by `write_build`. 
+        Nothing is fetched, see `revalidate`.
+        """
+        f = open(path)
+        try:
+            data = json.load(f)
+        finally:
+            f.close()
+        for key, item in data['items'].iteritems():
+            prod = Product(api=self.api, **item['product'])
+            prod.fetched = item['fetched']
+            self.build[key] = prod
+
+    def revalidate(self, max_age=DAY, workers=None):
+        """
+        Fetch the build products whose pages were fetched more than 
+        `max_age` seconds ago again, in parallel. 
+        Returns a dict {url:exception} of the ones that failed.
+        """
+        now = time.time()
+        stale = [
+            key for key, prod in self.build.iteritems() 
+            if prod and now-(prod.fetched or 0) > max_age
+            ]
+        if not stale:
+            return {}
+        products, failures = self.api.get_products_detailed(
+            [self.build[key].url for key in stale], workers, usecache=False
+            )
+        products = dict((p.url, p) for p in products)
+        for key in stale:
+            newp = products.get(self.build[key].url)
+            if newp is not None:
+                self.build[key].update(newp)
+        return failures
+
     def get_operating_systems(self):
         """
         Get avaialable operating systems.
         """
-        prods = self.api.get_products('hugbunadur', 'microsoft-windows')
+        prods = self._products('hugbunadur', 'microsoft-windows', None)
         return prods
 
     def get_sockets(self):
@@ -73,9 +134,9 @@ class Builder(object):
         Get available cpu sockets.
         """
         socks = self.api.cats['tolvuihlutir']['orgjorvar']
-        socks.remove('orgjorvakaelingar')
-        socks.remove('kaelikrem')
-        return socks
+        return [
+            s for s in socks if s not in ('orgjorvakaelingar', 'kaelikrem')
+            ]
 
     def get_ram_types(self):
         """
@@ -90,59 +151,124 @@ class Builder(object):
         (e.g. 8 and ddr3 for all 8gb ddr3).
         """
         #jn = True if size else False
-        rams = self.api.get_products(
+        rams = self._products(
             'tolvuihlutir', 'vinnsluminni-bordtolvur', ramtype
             )
         if not size:
             return rams
-        newrams = []
-        ms = r'.+%sGB %s' % (size, ramtype)
-        for ram in rams:
-            if re.match(ms, ram.name, re.IGNORECASE):
-                newrams.append(ram)
-        self.api.sort_products(newrams)
-        return newrams
+        #kits count by module size too
+        return self._with_capacity(rams, parse_capacity(size), 'module')
 
     def get_mobo_ram_type(self, motherboard):
-        match = None
-        for ram in self.get_ram_types():
-            if ram.lower() in motherboard.description.lower():
-                if match == 'ddr' or not match:
-                    match = ram
-        if not match:
+        self.api.fill_product(motherboard)
+        ramtype = motherboard.specs.get('ram')
+        if ramtype not in self.get_ram_types():
             raise TolvutekError(
                 'No supported ram type found for: {}'.format(motherboard)
                 )
-        return match
+        return ramtype
 
     def get_cpus(self, socket):
-        return self.api.get_products('tolvuihlutir', 'orgjorvar', socket)
+        return self._products('tolvuihlutir', 'orgjorvar', socket)
 
     def get_motherboards(self, socket):
-        return self.api.get_products('tolvuihlutir', 'modurbord', socket)
+        return self._products('tolvuihlutir', 'modurbord', socket)
 
     def get_drives(self, drivetype, size=None):        
-        if drivetype == 'HDD':
-            overview = self.api.get_products(
-                'tolvuihlutir', 'hardir-diskar-35', 'sata3'
-                )
-        elif drivetype == 'SSD':
-            overview = self.api.get_products(
-                'tolvuihlutir', 'ssd-diskar', 'sata3'
-                )
-        else:
+        try:
+            overview = self._products(*self.drive_paths[drivetype])
+        except KeyError:
             raise TolvutekError(
                 'drivetype argument must be "SSD" or "HDD"'
                 )
         if not size:
             return overview
-        ms = r'^%s.+' % size
-        newdrives = []
-        for drive in overview:
-            if re.match(ms, drive.name, re.IGNORECASE):
-                newdrives.append(drive)
-        self.api.sort_products(newdrives)
-        return newdrives
+        return self._with_capacity(overview, parse_capacity(size))
+
+    def _with_capacity(self, products, capacity, *specs):
+        """
+        Get the `products` of `capacity` GB, sorted, looked up in 
+        `api.spec_index` under 'capacity' and any other `specs`. 
+        The products are hydrated first so their specs are indexed.
+        """
+        if not capacity:
+            return []
+        hydrated, failures = self.api.get_products_detailed(
+            [p.url for p in products]
+            )
+        if failures:
+            raise TolvutekError(
+                u'Failed to get products: {}'.format(
+                    u', '.join(sorted(failures)))
+                )
+        index = self.api.spec_index
+        urls = set()
+        for spec in ('capacity',)+specs:
+            urls |= index.lookup(**{spec:capacity})
+        #products evicted from `api.products` have left the index
+        for p in hydrated:
+            if p.url not in index and capacity in (
+                p.specs.get(spec) for spec in ('capacity',)+specs
+                ):
+                urls.add(p.url)
+        matches = [p for p in products if p.url in urls]
+        self.api.sort_products(matches)
+        return matches
+
+    def prefetch(self, socket):
+        """
+        Start loading the candidates for the build steps after 
+        `socket` is chosen in the background: cpus and motherboards 
+        for `socket`, hydrated, and all ram and drive listings.
+        The get_* methods then return from the loaded listings.
+        """
+        self._load(('tolvuihlutir', 'orgjorvar', socket), hydrate=True)
+        self._load(('tolvuihlutir', 'modurbord', socket), hydrate=True)
+        for ramtype in self.get_ram_types():
+            self._load(('tolvuihlutir', 'vinnsluminni-bordtolvur', ramtype))
+        for path in self.drive_paths.itervalues():
+            self._load(path)
+
+    def _load(self, path, hydrate=False):
+        """
+        Get an `AsyncResult` of the products in category `path`, 
+        loading them in the pool unless already loaded or loading.
+        """
+        with self._lock:
+            result = self.loaded.get(path)
+            if result is None:
+                if self.pool is None:
+                    self.pool = ThreadPool(self.workers)
+                result = self.loaded[path] = self.pool.apply_async(
+                    self._fetch, (path, hydrate)
+                    )
+        return result
+
+    def _fetch(self, path, hydrate=False):
+        products = self.api.get_products(*path)
+        if hydrate:
+            #the listing is ready now, details follow in the background
+            self.pool.apply_async(self._hydrate, (products,))
+        return products
+
+    def _hydrate(self, products):
+        self.api.get_products_detailed([p.url for p in products])
+        for product in products:
+            self.api.fill_product(product)
+
+    def _products(self, *path):
+        """
+        Get a list of the products in category `path`.
+        """
+        result = self._load(path)
+        try:
+            return list(result.get())
+        except Exception:
+            #don't keep failures, the next call tries again
+            with self._lock:
+                if self.loaded.get(path) is result:
+                    del self.loaded[path]
+            raise
 
     def _build_to_text(self):
         """
@@ -155,7 +281,7 @@ class Builder(object):
             if not prod: continue
             self.api.fill_product(prod)
             line = u'{name} - {discount_price} / {common_price} ({url})\n'.format(
-                **prod.__dict__
+                **prod.as_dict()
                 )
             t += line
             total+=prod.discount_price
@@ -167,25 +293,35 @@ class Builder(object):
 
     def write_build(self, bdir):
         """
-        Write `self.build` to file in given format.
+        Write `self.build` to build.txt and build.json in `bdir`. 
+        build.json holds the full product fields and when the page 
+        of each product was fetched, see `read_build`.
         """
         pj = os.path.join
         bdir = os.path.abspath(bdir)
         safe_make_dirs(bdir)
         textf = pj(bdir, 'build.txt')
-        shelf = shelve.open(pj(bdir,'build.shelf'))
 
-        #write text file
+        #write text file, hydrates the products
         text = self._build_to_text()
         f = open(textf, 'w')
         f.write(text.encode('utf-8'))
         f.close()     
 
-        #write shelf
+        #write build file
+        now = time.time()
+        items = {}
         for key, value in self.build.iteritems():
-            shelf[key] = value.url
-        shelf.sync()
-        shelf.close()
+            if not value: continue
+            items[key] = {
+                'fetched':value.fetched,
+                'product':value.as_dict()
+                }
+        f = open(pj(bdir, 'build.json'), 'w')
+        try:
+            json.dump({'snapshot':now, 'items':items}, f, indent=1)
+        finally:
+            f.close()
 
 class BuilderUI(object):
 
@@ -250,6 +386,7 @@ class BuilderUI(object):
             'Veldu sökkul:', 
             sockets,
             )
+        self.builder.prefetch(socket)
         b = self.build
         b['cpu'] = self.choice(
             'Veldu örgjörva:', 
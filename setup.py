@@ -29,5 +29,10 @@ setup(
     install_requires=['beautifulsoup4'],
     packages=[
         'tolvutek', 
-        ]
+        ],
+    entry_points={
+        'console_scripts':[
+            'tolvutek-crawl = tolvutek.crawler:main',
+            ]
+        }
     )
@@ -15,16 +15,36 @@
 # The above copyright notice and this permission notice shall be
 # included in all copies or substantial portions of the Software.
 
-import codecs
+import os
+import json
+import time
+import heapq
+import shelve
 import operator
 from urllib import urlencode, quote
 from cookielib import CookieJar
-from urllib2 import build_opener, HTTPCookieProcessor
+from urllib2 import Request, HTTPError
 import logging
+import threading
+from urlparse import urlparse
 from HTMLParser import HTMLParser
+from multiprocessing.pool import ThreadPool
 
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+
+#SqliteCache and DirectoryCache are re-exported for the `cache` argument
+from tolvutek.cache import (
+    CacheEntry, SqliteCache, DirectoryCache, LRUCache, SingleFlight, MINUTE
+    )
+from tolvutek.transport import Transport
+from tolvutek.sync import Change, fingerprint, diff_entries
+from tolvutek.index import CatalogIndex
+from tolvutek.specs import SpecIndex, extract_specs
+from tolvutek.scheduler import Scheduler
+from tolvutek.trace import NullTracer
+#mixed_decoder is re-exported, it was defined here before tolvutek.decoding
+from tolvutek.decoding import mixed_decoder, decode_mixed
 
 def get_log():
     log = logging.getLogger('tolvutek')
@@ -41,15 +61,90 @@ log = logging.getLogger('tolvutek')
 class TolvutekError(Exception):
     pass
 
+def _class_in(*names):
+    """
+    Get a SoupStrainer class matcher for tags having any of `names`.
+    """
+    names = set(names)
+    def match(classes):
+        return bool(classes) and not names.isdisjoint(classes.split())
+    return match
+
+def normalize_query(query):
+    """
+    Get search `query` lower cased with whitespace collapsed.
+    """
+    if isinstance(query, str):
+        query = query.decode('utf-8')
+    return u' '.join(query.lower().split())
+
+def parse_pricerange(pricerange):
+    """
+    Get (low, high) from a (low, high) pair or an advanced search 
+    price range like '0+-+250.000'.
+    """
+    if isinstance(pricerange, basestring):
+        pricerange = pricerange.replace('+', ' ').split('-')
+    low, high = [
+        int(p.replace('.', '').strip()) if isinstance(p, basestring) else int(p) 
+        for p in pricerange
+        ]
+    return low, high
+
+def _thousands(n):
+    return '{:,}'.format(n).replace(',', '.')
+
+def _detail_field(name):
+    """
+    Property for a detail field of `Product`, hydrates the 
+    product from its page the first time a detail is read.
+    """
+    slot = '_'+name
+    def get(self):
+        if not self.detailed:
+            self.api.fill_product(self)
+        return getattr(self, slot)
+    def set(self, value):
+        setattr(self, slot, value)
+    return property(get, set)
+
 class Product(object): 
+    """
+    A product. `summary_fields` are what product listings give, 
+    `detail_fields` are only on the product page and are filled 
+    in on first access (see `Tolvutek.fill_product`). 
+    `fetched` is when the product page was fetched, None until then.
+    """
+    summary_fields = ('name', 'discount_price', 'url')
+    detail_fields = (
+        'model_no', 'catalog_no', 'common_price', 
+        'description', 'add_to_cart_id', 'image_url'
+        )
+    fields = summary_fields+detail_fields
+    __slots__ = (
+        ('api', 'detailed', 'fetched', '_specs')+summary_fields
+        +tuple('_'+f for f in detail_fields)
+        )
+
+    model_no = _detail_field('model_no')
+    catalog_no = _detail_field('catalog_no')
+    common_price = _detail_field('common_price')
+    description = _detail_field('description')
+    add_to_cart_id = _detail_field('add_to_cart_id')
+    image_url = _detail_field('image_url')
+
     def __init__(self, api=None, **kwargs):
         self.api = api
+        self._specs = None
+        self.fetched = None
+        self.detailed = all(f in kwargs for f in self.detail_fields)
         for key,value in kwargs.iteritems():
             if key == 'common_price' or key == 'discount_price':
-                value = int(value.replace('.',''))
+                if isinstance(value, basestring):
+                    value = int(value.replace('.',''))
             elif isinstance(value, basestring):
                 value = unicode(value)
-            self.__setattr__(key,value)
+            setattr(self, key, value)
 
     def __str__(self):
         s = u'{} - {} kr.'.format(
@@ -60,13 +155,52 @@ class Product(object):
     def __unicode__(self):
         return str(self).decode('utf-8')
 
+    def __getstate__(self):
+        return (self.detailed, self.as_dict(), self.fetched)
 
-    def __getattribute__(self, attr):
-        try:
-            return super(Product, self).__getattribute__(attr)
-        except AttributeError:
-            self.api.fill_product(self)
-        return super(Product, self).__getattribute__(attr)                    
+    def __setstate__(self, state):
+        self.api = None
+        self._specs = None
+        self.detailed, fields = state[:2]
+        self.fetched = state[2] if len(state) > 2 else None
+        for key, value in fields.iteritems():
+            setattr(self, key, value)
+
+    @property
+    def specs(self):
+        """
+        Specs extracted from name and description (if detailed), 
+        see `tolvutek.specs.extract_specs`.
+        """
+        if self._specs is None:
+            fields = self.as_dict()
+            self._specs = extract_specs(
+                fields.get('name'), fields.get('description')
+                )
+        return self._specs
+
+    def as_dict(self):
+        """
+        Get a dict of the fields that are set, without hydrating.
+        """
+        d = {}
+        for f in self.fields:
+            try:
+                d[f] = getattr(self, f if f in self.summary_fields else '_'+f)
+            except AttributeError:
+                pass
+        return d
+
+    def update(self, other):
+        """
+        Copy all fields set on `other` product to this one.
+        """
+        for key, value in other.as_dict().iteritems():
+            setattr(self, key, value)
+        self.detailed = self.detailed or other.detailed
+        if other.fetched is not None:
+            self.fetched = other.fetched
+        self._specs = None
 
 class Tolvutek(object):
 
@@ -78,55 +212,205 @@ class Tolvutek(object):
     url_search = u'/leita'
     url_asearch = u'/leit'
 
-    def __init__(self, username=None, password=None):
-        self.soup_cache = {} #url:BeautifulSoup
-        self.session = self.get_session(username, password)
-        self.products = {} #url:Product dict
-        self.cats = self.get_categories()
-        
+    #rough ratio of a parsed soup's memory to its html length
+    soup_overhead = 10
+
+    #only the parts of each kind of page that are scraped
+    strainers = {
+        'categories':SoupStrainer('ul', attrs={'id':'valmynd'}),
+        'listing':SoupStrainer(
+            'div', attrs={'class':_class_in('box-middle', 'paginationControl')}
+            ),
+        'product':SoupStrainer(
+            'div', attrs={'class':_class_in('leftcontent', 'rightcontent')}
+            ),
+        'cart':SoupStrainer('div', attrs={'class':_class_in('details')}),
+        }
+
+    def __init__(
+        self, username=None, password=None, workers=4, 
+        cache=None, offline=False, 
+        soup_cache_entries=256, soup_cache_bytes=None, 
+        products_entries=4096, cache_html=False,
+        parser=None, strain=False, timeout=30, scheduler=None,
+        cats_snapshot=None, tracer=None, 
+        search_ttl=15*MINUTE, search_cache_entries=128
+        ):
+        """
+        `cache` is an optional persistent page cache 
+        (e.g. `SqliteCache` or `DirectoryCache`).
+        If `offline`, pages are only served from `cache` and 
+        nothing is fetched from the web.
+
+        `soup_cache` and `products` are LRU caches bounded by 
+        `soup_cache_entries`/`soup_cache_bytes` and `products_entries` 
+        (None for no limit).
+        If `cache_html`, `soup_cache` keeps the html instead of the 
+        parsed tree and pages are re-parsed on each hit. 
+        The specs of the products in `products` are extracted once 
+        and indexed in `spec_index` (a `SpecIndex`).
+
+        `parser` is the BeautifulSoup tree builder to use 
+        (e.g. 'lxml' or 'html.parser', default is the best available).
+        If `strain`, only the parts of pages that are scraped are 
+        parsed (see `strainers`).
+
+        `timeout` is the socket timeout in seconds for all requests.
+        All requests go through `scheduler` (a `Scheduler`) for 
+        rate limiting and retries, the default only retries.
+
+        `tracer` (a `tolvutek.trace.Tracer`) gets timing spans for 
+        fetching, decoding, parsing and extracting pages. 
+        The default does nothing.
+
+        Results of `search` and `advanced_search` are kept for 
+        `search_ttl` seconds in `search_cache`, an LRU cache 
+        of `search_cache_entries` queries.
+
+        Concurrent calls for the same page or product share one 
+        fetch (see `inflight`).
+
+        Nothing is fetched here. The session logs in before the first 
+        cart operation (see `login`) and `cats` are loaded on first 
+        access, from json file `cats_snapshot` if given and it exists.
+        """
+        self.workers = workers #max concurrent page fetches
+        self.cache = cache
+        self.offline = offline
+        self.cache_html = cache_html
+        self.parser = parser
+        self.strain = strain
+        self.timeout = timeout
+        self.scheduler = scheduler or Scheduler()
+        self.tracer = tracer or NullTracer()
+        self.soup_cache = LRUCache( #url:BeautifulSoup or html
+            max_entries=soup_cache_entries, max_bytes=soup_cache_bytes
+            )
+        self.username = username
+        self.password = password
+        self.logged_in = False
+        self.cats_snapshot = cats_snapshot
+        self._cats = None
+        self._lock = threading.Lock()
+        self.session = self._new_session()
+        self.spec_index = SpecIndex() #specs of the products in `products`
+        self.products = LRUCache( #url:Product
+            max_entries=products_entries, 
+            on_evict=lambda url, product: self.spec_index.remove(url)
+            )
+        self.inflight = SingleFlight() #page and product fetches under way
+        self.search_ttl = search_ttl
+        self.search_cache = LRUCache( #query key:(fetched, products)
+            max_entries=search_cache_entries
+            )
+        self.cart = None #products in cart when last fetched, None if stale
+
+    @property
+    def cats(self):
+        """
+        The category tree (see `get_categories`), loaded on first access.
+        """
+        if self._cats is None:
+            with self._lock:
+                if self._cats is None:
+                    self._cats = self.load_categories()
+        return self._cats
+
+    @cats.setter
+    def cats(self, cats):
+        self._cats = cats
+
+    def load_categories(self):
+        """
+        Get categories from `self.cats_snapshot` if it exists. 
+        Otherwise get them from the web and write the snapshot.
+        """
+        snapshot = self.cats_snapshot
+        if snapshot and os.path.exists(snapshot):
+            f = open(snapshot)
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        cats = self.get_categories()
+        if snapshot:
+            f = open(snapshot, 'w')
+            try:
+                json.dump(cats, f)
+            finally:
+                f.close()
+        return cats
+
     def search(self, query):
         """
         Search for products matching query.
         Returns a list of Product.
+        Case and whitespace in `query` don't matter.
         """
-        query = quote(query)
-        u = self.url_search+'/'+query
-        soup = self.get_soup(u)
-        return self.get_products(soup=soup)
+        query = normalize_query(query)
+        u = self.url_search+'/'+quote(query.encode('utf-8'))
+        return self._cached_search(('search', query), u)
 
-    def advanced_search(self, **kwargs):
+    def advanced_search(self, catalog=None, **kwargs):
         """
+        Search with any of the filters `title`, `productnr`, 
+        `pricerange` ((low, high) or e.g. '0+-+250.000'), 
+        `category` and `manufacture`. 
+        Returns a list of Product.
+
+        If `catalog` (a `CatalogIndex`, see `index_catalog`) is 
+        given the search is answered from it without fetching: 
+        `category` matches a part of the category path, `title` 
+        and `manufacture` words in the name and `productnr` the 
+        catalog or model number of detailed products.
         """
-        defs = {
+        params = {
             'title':'',
             'productnr':'',
-            'pricerange':'0+-+250.000',
+            'pricerange':(0, 250000),
             'category':'',
             'manufacture':''
             }
-        for key, value in defs.iteritems():
-            if not kwargs.has_key(key):
-                kwargs[key] = value
-            elif not key == 'pricerange': #can't quote pricerange cause reasons
-                kwargs[key] = quote(kwargs[key])
+        for key, value in kwargs.iteritems():
+            if key == 'pricerange':
+                params[key] = parse_pricerange(value)
+            elif key in params:
+                params[key] = normalize_query(value)
+        if catalog is not None:
+            return self._local_search(catalog, params)
+        quoted = dict(
+            (key, quote(value.encode('utf-8'))) 
+            for key, value in params.iteritems() if key != 'pricerange'
+            )
+        quoted['pricerange'] = '{}+-+{}'.format(
+            *[_thousands(p) for p in params['pricerange']]
+            )
         url = '?title={title}&productNr={productnr}&pricerange={pricerange}&category={category}&manufacture={manufacture}'
-        url = url.format(**kwargs)
+        url = url.format(**quoted)
         url = self.url_asearch+'/'+url
-        soup = self.get_soup(url)
-        return self.get_products(soup=soup)
+        key = ('advanced_search',)+tuple(sorted(params.iteritems()))
+        return self._cached_search(key, url)
 
-    def get_cart(self):
+    def get_cart(self, refresh=False):
         """
         Get products in cart for given session.
+        The cart is only fetched again after it's been changed 
+        through this session or if `refresh`.
         """
-        csoup = self.get_soup(self.url_cart, use_cache=False)
-        return self._extract_products(csoup, cart=True)
+        if self.cart is not None and not refresh:
+            return list(self.cart)
+        self.login()
+        csoup = self.get_soup(self.url_cart, use_cache=False, kind='cart')
+        self.cart = self._extract_products(csoup, cart=True)
+        return list(self.cart)
 
     def add_to_cart(self, product):
         """
         Add given product to cart.
         """
         body = {'varaId':product.add_to_cart_id}
+        self.login()
+        self.cart = None
         resp = self.post(self.url_add_to_cart, body)
         if resp.code >= 300:
             raise TolvutekError(
@@ -134,90 +418,317 @@ class Tolvutek(object):
                     product, resp.code)
                 )
 
+    def add_many_to_cart(self, products, workers=None):
+        """
+        Add all given products to cart, at most `workers` at a time. 
+        The cart is fetched once at the end to verify.
+
+        Returns a list of (product, error) tuples in the order of 
+        `products`, error is None for products that made it to the cart.
+        """
+        def add(product):
+            try:
+                self.add_to_cart(product)
+                return product, None
+            except Exception as e:
+                log.warning(u'Failed to add %s to cart: %r', product.url, e)
+                return product, e
+        results = self._map(add, products, workers)
+        incart = set(p.url for p in self.get_cart(refresh=True))
+        verified = []
+        for product, error in results:
+            if error is None and product.url not in incart:
+                error = TolvutekError(
+                    u'{} is not in cart after adding it.'.format(product)
+                    )
+            verified.append((product, error))
+        return verified
+
     def fill_product(self, product):
         """
         Fill given product with info from web.
+        Does nothing if the product is already detailed.
         """
+        if product.detailed:
+            return
         newp = self.get_product(product.url)
-        product.__dict__.update(newp.__dict__)
+        if newp is not product:
+            product.update(newp)
 
     def get_product(self, url, usecache=True):
         """
         Get a `Product` object from `soup`.
         """
+        url = self.get_url(url)
         if usecache:
             try:
                 return self.products[url]
             except KeyError:
                 pass
+        product, shared = self.inflight.do(
+            ('product', url, usecache), 
+            lambda: self._get_product(url, usecache)
+            )
+        if shared:
+            self.tracer.event('coalesced', url, kind='product')
+        return product
+
+    def _get_product(self, url, usecache=True):
         h = HTMLParser()
-        url = self.get_url(url)
-        soup = self.get_soup(url)
-        leftsoup = soup.find('div', 'leftcontent')
-        soup = soup.find('div', 'rightcontent')
-        info = soup.findAll('span', 'modelnr')
-
-        product = Product(
-            api=self,
-            model_no = h.unescape(info[0].contents[0])[len('typunumer: '):],
-            catalog_no = h.unescape(info[1].contents[0])[len('Vorunumer: '):],
-            common_price = info[2].contents[0][len('agv: '):-3],
-            name = soup.find('h2').contents[0],
-            discount_price = soup.find('div', 'price').contents[0][:-3],
-            description = h.unescape(soup.find('div', 'boxinfo').contents[2]).strip(),
-            add_to_cart_id = soup.find('input').attrs['value'],
-            image_url = leftsoup.find('a', attrs={'rel':'prettyPhoto'}).attrs['href'],
-            url = self.get_url(url)
-            )    
-        self.products[url] = product
+        soup, fetched = self._get_soup(url, use_cache=usecache, kind='product')
+        with self.tracer.span('extract', url, count=1):
+            leftsoup = soup.find('div', 'leftcontent')
+            soup = soup.find('div', 'rightcontent')
+            info = soup.findAll('span', 'modelnr')
+
+            product = Product(
+                api=self,
+                model_no = h.unescape(info[0].contents[0])[len('typunumer: '):],
+                catalog_no = h.unescape(info[1].contents[0])[len('Vorunumer: '):],
+                common_price = info[2].contents[0][len('agv: '):-3],
+                name = soup.find('h2').contents[0],
+                discount_price = soup.find('div', 'price').contents[0][:-3],
+                description = h.unescape(soup.find('div', 'boxinfo').contents[2]).strip(),
+                add_to_cart_id = soup.find('input').attrs['value'],
+                image_url = leftsoup.find('a', attrs={'rel':'prettyPhoto'}).attrs['href'],
+                url = self.get_url(url)
+                )    
+            product.fetched = fetched
+            #index first, evicting the product drops it again
+            self.spec_index.add(url, product.specs)
+            self.products[url] = product
         return product
 
+    def get_products_detailed(self, urls, workers=None, usecache=True):
+        """
+        Get fully scraped `Product` objects for all given urls, 
+        fetching at most `workers` product pages at a time.
+        Products already in `self.products` are not fetched again 
+        unless `usecache` is False.
+
+        Returns a tuple (products, failures) where `products` is in 
+        the order of `urls` and `failures` is a dict {url:exception} 
+        of the urls that could not be scraped.
+        """
+        urls = [self.get_url(url) for url in urls]
+        found = {}
+        todo = []
+        for url in urls:
+            if url in found or url in todo:
+                continue
+            try:
+                if not usecache:
+                    raise KeyError(url)
+                found[url] = self.products[url]
+            except KeyError:
+                todo.append(url)
+
+        def fetch(url):
+            try:
+                return self.get_product(url, usecache=usecache), None
+            except Exception as e:
+                log.warning(u'Failed to get product %s: %r', url, e)
+                return None, e
+
+        failures = {}
+        for url, (product, error) in zip(todo, self._map(fetch, todo, workers)):
+            if error is not None:
+                failures[url] = error
+            else:
+                found[url] = product
+        products = [found[url] for url in urls if url in found]
+        return products, failures
+
     def get_products(
         self,
         cat=None,
         subcat=None,
         subsubcat=None, 
         soup=None,
-        quick=True
+        quick=True,
+        workers=None,
+        use_cache=True
         ):
         """
         Get all products in given category and subcategory as a list.
         Can also take a `BeautifulSoup` of a products page.
         If `just_names`, returnes a dict {'productname':'url'}. 
         Individual products will then not be scraped.
+
+        Remaining pages are fetched concurrently, at most `workers` 
+        at a time (defaults to `self.workers`). 
+        If not `use_cache`, pages are fetched again even when cached.
         """
         if not soup:
-            u = u'/{}/{}'.format(cat,subcat)
-            if subsubcat:
-                u+=u'/'+subsubcat
-            u+=u'?'
-            url = self.url_base+self.url_product_base+u
+            url = self.category_url(cat, subcat, subsubcat)
             log.debug(u'product url: %s', url)
-            soup = self.get_soup(url)
-        pages = soup.find('div', 'paginationControl')
-        if not pages:
-            products = self._extract_products(
-                soup, quick=quick
-                )
-            self.sort_products(products)
-            return products
-        pages = pages.findAll('a')
-        #strip the garbage links
-        pages = pages[2:-2]
-        products = self._extract_products(soup, quick=quick)        
-        for page in pages[1:]:
-            soup = self.get_soup(self.url_base+page.attrs['href'])
-            ps = self._extract_products(soup, quick=quick)
-            products += ps
+            soup = self.get_soup(url, use_cache=use_cache, kind='listing')
+        products = self._extract_products(soup, quick=quick)
+        soups = self._map(
+            lambda url: self.get_soup(url, use_cache=use_cache, kind='listing'), 
+            self._page_urls(soup), workers
+            )
+        for soup in soups:
+            products += self._extract_products(soup, quick=quick)
         self.sort_products(products)
         return products
 
+    def iter_products(
+        self, 
+        cat=None, 
+        subcat=None, 
+        subsubcat=None, 
+        soup=None, 
+        quick=True
+        ):
+        """
+        Like `get_products` but yields products page by page as 
+        they are parsed, unsorted. The next page is fetched in 
+        the background while the current one is consumed.
+        """
+        if not soup:
+            url = self.category_url(cat, subcat, subsubcat)
+            soup = self.get_soup(url, kind='listing')
+        urls = self._page_urls(soup)
+        pool = ThreadPool(1) if urls else None
+        try:
+            for i in xrange(len(urls)+1):
+                if i < len(urls):
+                    nextsoup = pool.apply_async(
+                        self.get_soup, (urls[i],), {'kind':'listing'}
+                        )
+                for product in self._extract_products(soup, quick=quick):
+                    yield product
+                if i < len(urls):
+                    soup = nextsoup.get()
+        finally:
+            if pool:
+                pool.close()
+
+    def sync_catalog(self, statefile, paths=None, workers=None):
+        """
+        Walk the category tree and yield a `Change` for every product 
+        that was added, removed or changed price since last sync.
+        Listing fingerprints are kept in shelve `statefile` between runs. 
+        Product pages are only fetched for new and re-priced products.
+
+        `paths` is an optional list of (cat, subcat, subsubcat) 
+        tuples to sync instead of all of `category_paths()`.
+        """
+        state = shelve.open(statefile)
+        try:
+            for path in paths or self.category_paths():
+                for change in self._sync_category(state, path, workers):
+                    yield change
+        finally:
+            state.close()
+
+    def _sync_category(self, state, path, workers=None):
+        """
+        Sync one category path against `state`, see `sync_catalog`.
+        """
+        def get_page(url):
+            return self.get_soup(url, use_cache=False, kind='listing')
+        key = '/'.join(p for p in path if p).encode('utf-8')
+        url = self.category_url(*path)
+        first = get_page(url)
+        urls = self._page_urls(first)
+        soups = [first]+self._map(get_page, urls, workers)
+
+        pages = {} #page url:fingerprint
+        entries = {} #product url:(name, discount_price)
+        for purl, soup in zip([url]+urls, soups):
+            listing = [
+                (self.get_url(p.url), p.name, p.discount_price)
+                for p in self._extract_products(soup, quick=True)
+                ]
+            pages[purl] = fingerprint(listing)
+            for u, name, price in listing:
+                entries[u] = (name, price)
+        old = state.get(key, {'pages':{}, 'entries':{}})
+        if old['pages'] == pages:
+            return
+        added, removed, changed = diff_entries(old['entries'], entries)
+        products, failures = self.get_products_detailed(
+            added+changed, workers, usecache=False
+            )
+        products = dict((p.url, p) for p in products)
+        for u in added:
+            if u in products:
+                yield Change('added', key, u, products[u], None, entries[u][1])
+        for u in changed:
+            if u in products:
+                yield Change(
+                    'price', key, u, products[u], 
+                    old['entries'][u][1], entries[u][1]
+                    )
+        for u in removed:
+            yield Change('removed', key, u, None, old['entries'][u][1], None)
+        if failures:
+            #keep the old entries of failed products and drop the 
+            #page fingerprints so they are synced again next run
+            for u in failures:
+                if u in old['entries']:
+                    entries[u] = old['entries'][u]
+                else:
+                    del entries[u]
+            pages = {}
+        state[key] = {'pages':pages, 'entries':entries}
+        state.sync()
+
+    def index_catalog(self, paths=None, quick=True, index=None):
+        """
+        Crawl given (cat, subcat, subsubcat) `paths` (default all of 
+        `category_paths()`) into a `CatalogIndex`. Products are 
+        indexed under the category path joined with '/'.
+        """
+        if index is None:
+            index = CatalogIndex()
+        for path in paths or self.category_paths():
+            category = u'/'.join(p for p in path if p)
+            index.extend(self.iter_products(*path, quick=quick), category)
+        return index
+
+    def category_paths(self):
+        """
+        Get (cat, subcat, subsubcat) tuples for all the leaf 
+        categories in `self.cats`. subsubcat is None for 
+        sub categories that have none.
+        """
+        paths = []
+        for cat, subcats in sorted(self.cats.iteritems()):
+            for subcat, subsubcats in sorted(subcats.iteritems()):
+                if not subsubcats:
+                    paths.append((cat, subcat, None))
+                for subsubcat in subsubcats:
+                    paths.append((cat, subcat, subsubcat))
+        return paths
+
+    def category_url(self, cat, subcat, subsubcat=None):
+        """
+        Get absolute url of the product listing for given category.
+        """
+        u = u'/{}/{}'.format(cat,subcat)
+        if subsubcat:
+            u+=u'/'+subsubcat
+        u+=u'?'
+        return self.url_base+self.url_product_base+u
+
     def sort_products(self, products, field='discount_price'):
         """
         Sort given product list by given field.
         """
         products.sort(key=operator.attrgetter(field))        
 
+    def top_products(self, products, k, field='discount_price', largest=False):
+        """
+        Get the `k` products with the smallest (or `largest`) `field` 
+        from any iterable of products, sorted. 
+        Only `k` products are held in memory at a time.
+        """
+        select = heapq.nlargest if largest else heapq.nsmallest
+        return select(k, products, key=operator.attrgetter(field))
+
     def get_categories(self):
         """
         Get all product categories, sub categories and sub-sub categories.
@@ -225,7 +736,7 @@ class Tolvutek(object):
         """
         def stripurl(url):
             return url.strip('/vorur/').strip('?')
-        soup = self.get_soup(self.url_base)
+        soup = self.get_soup(self.url_base, kind='categories')
         catsoup = soup.find('ul', attrs={'id':'valmynd'})
 
         #all the <li class=''> trees in a list
@@ -253,33 +764,112 @@ class Tolvutek(object):
             cats[catname] = subcats
         return cats                
 
-    def get_soup(self, url, body=None, use_cache=True):
+    def get_soup(self, url, body=None, use_cache=True, kind=None):
         """
         Get a BeautifulSoup object for given url and request body.
+        `kind` is the kind of page (a key in `strainers`), when 
+        `self.strain` is set only those parts of the page are parsed.
+        """
+        return self._get_soup(url, body, use_cache, kind)[0]
+
+    def _get_soup(self, url, body=None, use_cache=True, kind=None):
+        """
+        Like `get_soup` but returns (soup, when the page was fetched).
         """
         url = self.get_url(url)
         log.debug(url)
+        key = (url, kind) if self.strain and kind else url
         if use_cache:
             try:
-                return self.soup_cache[url]
+                fetched, cached = self.soup_cache[key]
             except KeyError:
-                pass        
-        soup = BeautifulSoup(self._get_html(url, body=body))
-        self.soup_cache[url] = soup
-        return soup
+                pass
+            else:
+                self.tracer.event('soup_cache', url, hit=True)
+                if self.cache_html:
+                    return self.make_soup(cached, kind, url), fetched
+                return cached, fetched
+        if body is not None:
+            return self._fetch_soup(url, body, use_cache, kind, key)[1:]
+        (html, soup, fetched), shared = self.inflight.do(
+            ('soup', key, use_cache), 
+            lambda: self._fetch_soup(url, body, use_cache, kind, key)
+            )
+        if shared:
+            self.tracer.event('coalesced', url, kind=kind)
+            if self.cache_html:
+                #each caller gets its own tree
+                return self.make_soup(html, kind, url), fetched
+        return soup, fetched
+
+    def _fetch_soup(self, url, body, use_cache, kind, key):
+        """
+        Fetch and parse a page for `get_soup`, 
+        returns (html, soup, when the page was fetched).
+        """
+        html, fetched = self._get_html(url, body=body, use_cache=use_cache)
+        soup = self.make_soup(html, kind, url)
+        if self.cache_html:
+            self.soup_cache.put(key, (fetched, html), len(html))
+        else:
+            self.soup_cache.put(
+                key, (fetched, soup), len(html)*self.soup_overhead
+                )
+        return html, soup, fetched
+
+    def make_soup(self, html, kind=None, url=None):
+        """
+        Parse html with `self.parser`, restricted to the 
+        strainer for `kind` if `self.strain` is set.
+        """
+        strainer = self.strainers.get(kind) if self.strain else None
+        with self.tracer.span('parse', url, kind=kind, bytes=len(html)):
+            return BeautifulSoup(html, self.parser, parse_only=strainer)
 
     def get_session(self, user, pw):
         """
-        Get the session urlopener.
+        Get a logged in session urlopener.
+        """
+        opener = self._new_session()
+        self._login(opener, user, pw)
+        return opener
+
+    def login(self):
+        """
+        Log the session in with the credentials given to `__init__`. 
+        Only done once, cart operations call this first.
+        """
+        if self.logged_in:
+            return
+        with self._lock:
+            if not self.logged_in:
+                self._login(self.session, self.username, self.password)
+                self.logged_in = True
+
+    def _new_session(self):
+        """
+        Get a new session urlopener with its own cookie jar.
+        Connections are kept alive and pooled per host, 
+        at most `self.workers` idle ones.
+        """
+        return Transport(
+            CookieJar(), timeout=self.timeout, maxsize=self.workers
+            )
+
+    def _login(self, opener, user, pw):
+        """
+        Log in with `opener` and set `self.cookie`.
         """
-        cj = CookieJar()
-        opener = build_opener(HTTPCookieProcessor(cj))
         data = urlencode(
             {'username':user,'password':pw}
             )
-        opener.open(self.url_base+self.url_login, data)
-        self.cookie = cj._cookies['tolvutek.is']['/']['PHPSESSID']        
-        return opener
+        url = self.url_base+self.url_login
+        self._check_online(url)
+        self.scheduler.call(
+            url, lambda: opener.open(url, data), idempotent=False
+            )
+        host = urlparse(self.url_base).hostname
+        self.cookie = opener.cookiejar._cookies[host]['/']['PHPSESSID']
 
     def post(self, url, body):
         """
@@ -287,7 +877,10 @@ class Tolvutek(object):
         """
         url = self.get_url(url)
         body = urlencode(body)
-        response = self.session.open(url, body)
+        self._check_online(url)
+        response = self.scheduler.call(
+            url, lambda: self.session.open(url, body), idempotent=False
+            )
         return response
         
     def get_url(self, url):
@@ -298,10 +891,97 @@ class Tolvutek(object):
             url = self.url_base+url
         return url        
 
+    def _page_urls(self, soup):
+        """
+        Get urls of the remaining pages linked from the 
+        pagination control in given listing soup, in page order.
+        """
+        pages = soup.find('div', 'paginationControl')
+        if not pages:
+            return []
+        pages = pages.findAll('a')
+        #strip the garbage links
+        pages = pages[2:-2]
+        return [self.url_base+page.attrs['href'] for page in pages[1:]]
+
+    def _map(self, func, items, workers=None):
+        """
+        Like `map` but runs `func` in a pool of at most `workers` 
+        threads. Results are returned in the order of `items`.
+        """
+        if workers is None:
+            workers = self.workers
+        items = list(items)
+        if not workers or workers <= 1 or len(items) <= 1:
+            return map(func, items)
+        pool = ThreadPool(min(workers, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            #not joined, that only waits for the pool's handler threads 
+            #to notice. workers exit on their own once the tasks are done.
+            pool.close()
+
+    def _cached_search(self, key, url):
+        """
+        Get the products of search result `url` from `search_cache`, 
+        fetching them again when older than `search_ttl`.
+        """
+        try:
+            fetched, products = self.search_cache[key]
+        except KeyError:
+            pass
+        else:
+            if time.time()-fetched < self.search_ttl:
+                return list(products)
+        def fetch():
+            #every page is revalidated, the result is what expired
+            soup = self.get_soup(url, use_cache=False, kind='listing')
+            products = self.get_products(soup=soup, use_cache=False)
+            self.search_cache.put(key, (time.time(), products))
+            return products
+        products, shared = self.inflight.do(key, fetch)
+        return list(products)
+
+    def _local_search(self, catalog, params):
+        """
+        Answer `advanced_search` `params` from `catalog`.
+        """
+        low, high = params['pricerange']
+        categories = None
+        if params['category']:
+            categories = set(
+                c for c in catalog.categories 
+                if c and params['category'] in c.lower().split('/')
+                )
+        words = params['title'].split()
+        products = []
+        for product in catalog.range(low, high):
+            if categories is not None:
+                if catalog.category_of(product) not in categories:
+                    continue
+            name = product.name.lower()
+            if not all(w in name for w in words):
+                continue
+            if params['manufacture'] and params['manufacture'] not in name.split():
+                continue
+            if params['productnr']:
+                fields = product.as_dict()
+                numbers = [
+                    fields[f].lower() for f in ('catalog_no', 'model_no') 
+                    if fields.get(f)
+                    ]
+                if params['productnr'] not in numbers:
+                    continue
+            products.append(product)
+        return products
+
     def _extract_products(self, soup, cart=False, quick=False):
         """
         Get products from given BeautifulSoup.
         Set `cart` to True if `soup` is a cart.
+        Unless `quick`, raises `TolvutekError` listing the product 
+        pages that could not be scraped once all have been tried.
 
         If `just_names`, returns a dict {'productname':'url'}.
         """
@@ -309,37 +989,96 @@ class Tolvutek(object):
             product_soups = soup.findAll('div', 'details')
         else:
             product_soups = soup.findAll('div', attrs={'class':'box-middle'})
+        if not quick:
+            purls = [s.find('a').attrs['href'] for s in product_soups]
+            products, failures = self.get_products_detailed(purls)
+            if failures:
+                raise TolvutekError(
+                    u'Failed to get {} of {} products: {}'.format(
+                        len(failures), len(purls), 
+                        u', '.join(sorted(failures)))
+                    )
+            return products
         products = []
-        for s in product_soups:
-            purl = s.find('a').attrs['href']
-            if quick:
+        with self.tracer.span('extract', count=len(product_soups)):
+            for s in product_soups:
+                purl = s.find('a').attrs['href']
                 name = s.findAll('a')[1].contents[0].strip()
                 price = s.find('div', 'price').contents[0]
                 prod = Product(
-                    api=self, name=name, discount_price=price, url=purl
+                    api=self, name=name, discount_price=price, 
+                    url=self.get_url(purl)
                     )
-            else:
-                prod = self.get_product(purl)
-            products.append(prod)
+                products.append(prod)
         return products
 
-    def _get_html(self, url, body=None):
+    def _get_html(self, url, body=None, use_cache=True):
+        """
+        Get (decoded html, when it was fetched) for url. 
+        GET requests go through `self.cache` when set. 
+        If not `use_cache`, cached pages are revalidated 
+        even when they are still fresh.
+        """
         if body is not None:
             body = urlencode(body)
-        html = self.session.open(url, body).read()
-        html = html.decode('utf-8', 'mixed')
-        return html
-
-
-last_pos = -1
-def mixed_decoder(unicode_error):
-    global last_pos
-    string = unicode_error[1]
-    pos = unicode_error.start
-    if pos <= last_pos:
-        pos = last_pos+1
-    last_pos = pos
-    new_char = string[pos].decode('ISO-8859-1')
-    return new_char, pos+1
-
-codecs.register_error('mixed', mixed_decoder)
+        with self.tracer.span('fetch', url) as span:
+            if body is None and self.cache and self.cache.cacheable(url):
+                html, fetched = self._get_cached_html(url, use_cache, span)
+            else:
+                self._check_online(url)
+                fetched = time.time()
+                html = self.scheduler.call(
+                    url, lambda: self.session.open(url, body).read(), 
+                    idempotent=body is None
+                    )
+            span.set(bytes=len(html))
+        with self.tracer.span('decode', url, bytes=len(html)):
+            html = decode_mixed(html)
+        return html, fetched
+
+    def _get_cached_html(self, url, use_cache=True, span=None):
+        """
+        Get (raw html, when it was fetched or last validated) for 
+        url from `self.cache`, fetching or revalidating it 
+        (ETag/Last-Modified) when stale.
+        Sets `cache` on trace `span` to 'hit', 'not_modified' or 'miss'.
+        """
+        span = span or NullTracer._span
+        entry = self.cache.get(url)
+        if entry is not None:
+            if self.offline or (use_cache and self.cache.is_fresh(url, entry)):
+                span.set(cache='hit')
+                return entry.html, entry.fetched
+        self._check_online(url)
+        request = Request(url)
+        if entry is not None:
+            if entry.etag:
+                request.add_header('If-None-Match', entry.etag)
+            if entry.last_modified:
+                request.add_header('If-Modified-Since', entry.last_modified)
+        fetched = time.time()
+        try:
+            response = self.scheduler.call(
+                url, lambda: self.session.open(request)
+                )
+        except HTTPError as e:
+            if e.code == 304 and entry is not None:
+                log.debug(u'not modified: %s', url)
+                self.cache.touch(url)
+                span.set(cache='not_modified')
+                return entry.html, fetched
+            raise
+        span.set(cache='miss')
+        html = response.read()
+        info = response.info()
+        self.cache.set(url, CacheEntry(
+            html, info.getheader('ETag'), info.getheader('Last-Modified'), 
+            fetched
+            ))
+        return html, fetched
+
+    def _check_online(self, url):
+        if self.offline:
+            raise TolvutekError(
+                u'Can not fetch {} in offline mode.'.format(url)
+                )
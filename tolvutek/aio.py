@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Non-blocking front for `Tolvutek`.
+"""
+
+import threading
+from multiprocessing.pool import ThreadPool
+
+from tolvutek import Tolvutek
+
+class LimitedSession(object):
+    """
+    Wraps a session so at most `semaphore` requests are open at once.
+    """
+    def __init__(self, session, semaphore):
+        self.session = session
+        self.semaphore = semaphore
+
+    def open(self, *args, **kwargs):
+        with self.semaphore:
+            return self.session.open(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.session, attr)
+
+class AsyncTolvutek(object):
+    """
+    Same surface as `Tolvutek` but every method returns right away
+    with an `AsyncResult` (see `multiprocessing.pool`). Call its
+    `get()` for the value or give a `callback`.
+
+    Fetching and parsing happen in a pool of `concurrency` threads
+    sharing one session and cookie jar. At most `concurrency`
+    requests are in flight at once, including the pages the
+    calls fetch concurrently themselves.
+    """
+    def __init__(self, username=None, password=None, concurrency=8, **kwargs):
+        kwargs.setdefault('workers', concurrency)
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.pool = ThreadPool(concurrency)
+        self.api = Tolvutek(username, password, **kwargs)
+        self.api.session = LimitedSession(self.api.session, self.semaphore)
+
+    def search(self, query, callback=None):
+        return self._submit(self.api.search, (query,), {}, callback)
+
+    def advanced_search(self, callback=None, **kwargs):
+        return self._submit(self.api.advanced_search, (), kwargs, callback)
+
+    def get_products(self, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        return self._submit(self.api.get_products, args, kwargs, callback)
+
+    def get_products_detailed(self, urls, workers=None, callback=None):
+        return self._submit(
+            self.api.get_products_detailed, (urls, workers), {}, callback
+            )
+
+    def get_product(self, url, usecache=True, callback=None):
+        return self._submit(self.api.get_product, (url, usecache), {}, callback)
+
+    def get_categories(self, callback=None):
+        return self._submit(self.api.get_categories, (), {}, callback)
+
+    def get_cart(self, refresh=False, callback=None):
+        return self._submit(self.api.get_cart, (refresh,), {}, callback)
+
+    def add_to_cart(self, product, callback=None):
+        return self._submit(self.api.add_to_cart, (product,), {}, callback)
+
+    def add_many_to_cart(self, products, workers=None, callback=None):
+        return self._submit(
+            self.api.add_many_to_cart, (products, workers), {}, callback
+            )
+
+    def close(self):
+        """
+        Finish pending calls and stop the pool.
+        """
+        self.pool.close()
+        self.pool.join()
+
+    def _submit(self, func, args, kwargs, callback):
+        return self.pool.apply_async(func, args, kwargs, callback)
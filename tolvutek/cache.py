@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Page and object caches for `Tolvutek`.
+Persistent caches store raw (undecoded) html keyed by absolute url.
+"""
+
+import os
+import sys
+import time
+import json
+import zlib
+import sqlite3
+import hashlib
+import threading
+from urlparse import urlparse
+from collections import OrderedDict
+
+MINUTE = 60
+HOUR = 60*MINUTE
+DAY = 24*HOUR
+
+class LRUCache(object):
+    """
+    Dict-like in-memory cache with least recently used eviction.
+    Bounded by `max_entries` and/or `max_bytes` (None for no limit).
+    Sizes are given with `put` or computed with `sizeof` 
+    (defaults to 1 per entry). `on_evict` is called with 
+    (key, value) of each evicted entry.
+    Keeps `hits`, `misses` and `evictions` counters.
+    """
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 1)
+        self.on_evict = on_evict
+        self.lock = threading.RLock()
+        self.data = OrderedDict() #key:(value, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, key):
+        with self.lock:
+            try:
+                item = self.data.pop(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            self.data[key] = item
+            self.hits += 1
+            return item[0]
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __delitem__(self, key):
+        with self.lock:
+            value, size = self.data.pop(key)
+            self.bytes -= size
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def put(self, key, value, size=None):
+        """
+        Add `value` under `key`, `size` overrides `self.sizeof`.
+        Least recently used entries are evicted to stay in bounds.
+        """
+        if size is None:
+            size = self.sizeof(value)
+        evicted = []
+        with self.lock:
+            if key in self.data:
+                del self[key]
+            self.data[key] = (value, size)
+            self.bytes += size
+            while len(self.data) > 1 and self._over_limit():
+                oldkey, (oldvalue, oldsize) = self.data.popitem(last=False)
+                self.bytes -= oldsize
+                self.evictions += 1
+                evicted.append((oldkey, oldvalue))
+        if self.on_evict:
+            for oldkey, oldvalue in evicted:
+                self.on_evict(oldkey, oldvalue)
+
+    def _over_limit(self):
+        if self.max_entries is not None and len(self.data) > self.max_entries:
+            return True
+        if self.max_bytes is not None and self.bytes > self.max_bytes:
+            return True
+        return False
+
+    def keys(self):
+        with self.lock:
+            return self.data.keys()
+
+    def values(self):
+        with self.lock:
+            return [value for value, size in self.data.itervalues()]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """
+        Get a dict of the counters and current size.
+        """
+        return {
+            'entries':len(self.data),
+            'bytes':self.bytes,
+            'hits':self.hits,
+            'misses':self.misses,
+            'evictions':self.evictions
+            }
+
+class SingleFlight(object):
+    """
+    Runs one call per key at a time. Callers asking for a key 
+    that is already being computed wait for that call and share 
+    its result or exception. Counts `coalesced` calls.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {} #key:_Call
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """
+        Get the result of `func()` for `key`, returns a tuple 
+        (result, shared) with `shared` True when another caller's 
+        call was waited for.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error[0], call.error[1], call.error[2]
+            return call.result, True
+        try:
+            call.result = func()
+        except:
+            call.error = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class CacheEntry(object):
+    def __init__(self, html, etag=None, last_modified=None, fetched=None):
+        self.html = html
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched = time.time() if fetched is None else fetched
+
+class BaseCache(object):
+    """
+    Base class for persistent page caches.
+    Subclasses implement `get`, `set` and `touch`.
+
+    `ttls` maps url classes (see `url_class`) to seconds a page
+    is considered fresh. A ttl of None means pages of that class
+    are never cached.
+    """
+    ttls = {
+        'categories':DAY,
+        'listing':HOUR,
+        'search':15*MINUTE,
+        'product':6*HOUR,
+        'cart':None,
+        }
+
+    def __init__(self, ttls=None):
+        self.ttls = dict(self.ttls)
+        if ttls:
+            self.ttls.update(ttls)
+
+    def url_class(self, url):
+        """
+        Get the class of given absolute url. One of
+        'categories', 'listing', 'search', 'cart' or 'product'.
+        """
+        path = urlparse(url).path
+        if path in ('', '/'):
+            return 'categories'
+        elif path.startswith('/vorur/'):
+            return 'listing'
+        elif path.startswith('/leit'):
+            return 'search'
+        elif path.startswith('/karfa'):
+            return 'cart'
+        return 'product'
+
+    def cacheable(self, url):
+        return self.ttls[self.url_class(url)] is not None
+
+    def is_fresh(self, url, entry, now=None):
+        """
+        Check whether given `CacheEntry` for `url` is within its ttl.
+        """
+        ttl = self.ttls[self.url_class(url)]
+        if ttl is None:
+            return False
+        if now is None:
+            now = time.time()
+        return now-entry.fetched < ttl
+
+    def get(self, url):
+        """
+        Get `CacheEntry` for url or None.
+        """
+        raise NotImplementedError
+
+    def set(self, url, entry):
+        """
+        Store `CacheEntry` for url.
+        """
+        raise NotImplementedError
+
+    def touch(self, url):
+        """
+        Mark entry for url as freshly validated.
+        """
+        raise NotImplementedError
+
+class SqliteCache(BaseCache):
+    """
+    Cache pages in a single sqlite database.
+    Html is stored zlib compressed.
+    """
+    def __init__(self, path, ttls=None):
+        super(SqliteCache, self).__init__(ttls)
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'url TEXT PRIMARY KEY, html BLOB, etag TEXT, '
+            'last_modified TEXT, fetched REAL)'
+            )
+        self.db.commit()
+
+    def get(self, url):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT html, etag, last_modified, fetched '
+                'FROM pages WHERE url=?', (url,)
+                ).fetchone()
+        if not row:
+            return None
+        html, etag, last_modified, fetched = row
+        return CacheEntry(
+            zlib.decompress(str(html)), etag, last_modified, fetched
+            )
+
+    def set(self, url, entry):
+        html = sqlite3.Binary(zlib.compress(entry.html))
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?,?,?,?,?)',
+                (url, html, entry.etag, entry.last_modified, entry.fetched)
+                )
+            self.db.commit()
+
+    def touch(self, url):
+        with self.lock:
+            self.db.execute(
+                'UPDATE pages SET fetched=? WHERE url=?', (time.time(), url)
+                )
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+class DirectoryCache(BaseCache):
+    """
+    Cache pages as compressed files in a directory.
+    Each file holds a json header line followed by the zlib
+    compressed html.
+    """
+    def __init__(self, path, ttls=None):
+        super(DirectoryCache, self).__init__(ttls)
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _filename(self, url):
+        return os.path.join(self.path, hashlib.sha1(url).hexdigest())
+
+    def get(self, url):
+        try:
+            f = open(self._filename(url), 'rb')
+        except IOError:
+            return None
+        try:
+            meta = json.loads(f.readline())
+            html = zlib.decompress(f.read())
+        finally:
+            f.close()
+        return CacheEntry(html, **meta)
+
+    def set(self, url, entry):
+        meta = {
+            'etag':entry.etag,
+            'last_modified':entry.last_modified,
+            'fetched':entry.fetched
+            }
+        fn = self._filename(url)
+        #unique per process too, forked workers share thread idents
+        tmp = '{}.{}.{}.tmp'.format(
+            fn, os.getpid(), threading.current_thread().ident
+            )
+        f = open(tmp, 'wb')
+        try:
+            f.write(json.dumps(meta)+'\n')
+            f.write(zlib.compress(entry.html))
+        finally:
+            f.close()
+        os.rename(tmp, fn)
+
+    def touch(self, url):
+        entry = self.get(url)
+        if entry is not None:
+            entry.fetched = time.time()
+            self.set(url, entry)
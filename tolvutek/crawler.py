@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Crawl the whole catalog in a pool of processes.
+
+Each leaf category is a shard crawled by one worker process with
+its own `Tolvutek` session into a JSON Lines file in the checkpoint
+directory. A finished shard is never crawled again, so an
+interrupted crawl resumes where it stopped. The shards are merged
+into one export file (see `tolvutek.export`), without duplicates.
+
+usage: python -m tolvutek.crawler OUTPUT [-c CHECKPOINT] [-p PROCESSES]
+                                         [--cache DIR]
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+import functools
+import multiprocessing
+
+from tolvutek import Tolvutek, TolvutekError
+from tolvutek.cache import BaseCache, DirectoryCache
+from tolvutek.export import open_writer, read_records
+
+log = logging.getLogger('tolvutek')
+
+#the Tolvutek of a worker process
+_api = None
+
+def _open_api(api_kwargs):
+    """
+    Get a `Tolvutek` for `api_kwargs`, opening its own cache
+    from the 'cache' factory if there is one.
+    """
+    api_kwargs = dict(api_kwargs)
+    cache = api_kwargs.get('cache')
+    if isinstance(cache, BaseCache):
+        #a forked worker would share its connection or files
+        raise TolvutekError(
+            u'Give the crawler a cache factory, not an open cache.'
+            )
+    if cache is not None:
+        api_kwargs['cache'] = cache()
+    return Tolvutek(**api_kwargs)
+
+def _init_worker(api_kwargs):
+    global _api
+    _api = _open_api(api_kwargs)
+
+def _crawl_shard(task):
+    """
+    Crawl category `path` into `shard` in a worker process.
+    Returns (path, number of products, error).
+    """
+    path, shard, quick = task
+    category = category_name(path)
+    try:
+        with open_writer(shard+'.tmp', 'jsonl') as writer:
+            for product in _api.iter_products(*path, quick=quick):
+                writer.write(product, category)
+        os.rename(shard+'.tmp', shard)
+    except Exception as e:
+        log.warning(u'Failed to crawl %s: %r', category, e)
+        if os.path.exists(shard+'.tmp'):
+            os.remove(shard+'.tmp')
+        return path, 0, repr(e)
+    return path, writer.count, None
+
+def category_name(path):
+    """
+    Get the category name of (cat, subcat, subsubcat) `path`,
+    joined with '/' as in `Tolvutek.index_catalog`.
+    """
+    return u'/'.join(p for p in path if p)
+
+def shard_name(path):
+    name = category_name(path).encode('utf-8')
+    return 'shard-{}.jsonl'.format(hashlib.sha1(name).hexdigest()[:16])
+
+def check_checkpoint(checkpoint, quick):
+    """
+    Record the crawl mode in a manifest in directory `checkpoint`, 
+    raising `TolvutekError` if its shards were crawled in the other 
+    mode (quick shards lack the details a full crawl needs).
+    """
+    path = os.path.join(checkpoint, 'manifest.json')
+    if os.path.exists(path):
+        f = open(path)
+        try:
+            manifest = json.load(f)
+        finally:
+            f.close()
+        if manifest['quick'] != quick:
+            raise TolvutekError(
+                u'Checkpoint {} holds a {} crawl, not a {} one.'.format(
+                    checkpoint, 
+                    u'quick' if manifest['quick'] else u'full', 
+                    u'quick' if quick else u'full')
+                )
+        return
+    if any(name.startswith('shard-') for name in os.listdir(checkpoint)):
+        raise TolvutekError(
+            u'Checkpoint {} has no manifest, its crawl mode is '
+            u'unknown.'.format(checkpoint)
+            )
+    f = open(path, 'w')
+    try:
+        json.dump({'quick':quick}, f)
+    finally:
+        f.close()
+
+def crawl(
+    output, paths=None, checkpoint=None, processes=None,
+    quick=True, format=None, api_kwargs=None
+    ):
+    """
+    Crawl (cat, subcat, subsubcat) `paths` (default all leaf
+    categories) into export file `output` with `processes` worker
+    processes (default one per cpu).
+
+    Shards are kept in directory `checkpoint`, run again with the
+    same one and `quick` to resume, a checkpoint of the other mode 
+    raises `TolvutekError`. Without it a temporary directory is 
+    used and removed when done.
+
+    Products are written once, the first time their url (or
+    catalog_no when `quick` is False) is seen, in the order of
+    `paths`. `api_kwargs` are given to each `Tolvutek`, except
+    that 'cache' must be a callable opening the cache, e.g.
+    `functools.partial(SqliteCache, 'pages.db')`. Each worker
+    process calls it to open its own, an open cache would be
+    shared with the forked workers.
+
+    Returns (number of products written, {path:error} of the
+    categories that failed). Failed categories are left out
+    of `output` and crawled again when resumed.
+    """
+    api_kwargs = api_kwargs or {}
+    if paths is None:
+        paths = _open_api(api_kwargs).category_paths()
+    unique = []
+    for path in paths:
+        if tuple(path) not in unique:
+            unique.append(tuple(path))
+    paths = unique
+    tmpdir = None
+    if checkpoint is None:
+        checkpoint = tmpdir = tempfile.mkdtemp(prefix='tolvutek-crawl-')
+    elif not os.path.isdir(checkpoint):
+        os.makedirs(checkpoint)
+    try:
+        check_checkpoint(checkpoint, quick)
+        shards = dict(
+            (path, os.path.join(checkpoint, shard_name(path)))
+            for path in paths
+            )
+        todo = [
+            (path, shards[path], quick) for path in paths
+            if not os.path.exists(shards[path])
+            ]
+        log.info(
+            u'crawling %d of %d categories', len(todo), len(paths)
+            )
+        failures = {}
+        if todo:
+            pool = multiprocessing.Pool(
+                processes, _init_worker, (api_kwargs,)
+                )
+            try:
+                for path, count, error in pool.imap_unordered(_crawl_shard, todo):
+                    if error:
+                        failures[path] = error
+                    else:
+                        log.info(u'%s: %d products', category_name(path), count)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        count = merge(
+            [shards[path] for path in paths if path not in failures],
+            output, format, quick
+            )
+        return count, failures
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+def merge(shards, output, format=None, quick=True):
+    """
+    Merge JSON Lines `shards` into export file `output`,
+    dropping products seen before by url, or by catalog_no
+    too unless `quick`. Returns the number of products written.
+    """
+    urls = set()
+    catalog_nos = set()
+    count = 0
+    with open_writer(output, format) as writer:
+        for shard in shards:
+            for fields in read_records(shard, 'jsonl'):
+                if fields['url'] in urls:
+                    continue
+                catalog_no = None if quick else fields.get('catalog_no')
+                if catalog_no and catalog_no in catalog_nos:
+                    continue
+                urls.add(fields['url'])
+                if catalog_no:
+                    catalog_nos.add(catalog_no)
+                writer.write_record(fields)
+                count += 1
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Crawl the tolvutek.is catalog into one file.'
+        )
+    parser.add_argument('output',
+                        help='export file, format by extension '
+                        '(.jsonl, .csv, .bin or .parquet)')
+    parser.add_argument('-c', '--checkpoint',
+                        help='directory to keep progress in, '
+                        'rerun with the same one to resume')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help='worker processes (default one per cpu)')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='concurrent page fetches per process')
+    parser.add_argument('-f', '--format', default=None,
+                        help='export format, overrides the extension')
+    parser.add_argument('--full', action='store_true',
+                        help='scrape every product page too')
+    parser.add_argument('--cats-snapshot', default=None,
+                        help='json file to load/save the category tree')
+    parser.add_argument('--cache', default=None, metavar='DIR',
+                        help='directory to cache pages in, '
+                        'shared by the worker processes')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    api_kwargs = {'workers':args.workers, 'cats_snapshot':args.cats_snapshot}
+    if args.cache:
+        api_kwargs['cache'] = functools.partial(DirectoryCache, args.cache)
+    count, failures = crawl(
+        args.output, checkpoint=args.checkpoint, processes=args.processes,
+        quick=not args.full, format=args.format, api_kwargs=api_kwargs
+        )
+    print '{} products written to {}'.format(count, args.output)
+    for path, error in sorted(failures.iteritems()):
+        print 'failed: {} {}'.format(category_name(path), error)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Decoding of pages mixing UTF-8 and ISO-8859-1.
+
+Registers the 'mixed' codec error handler, use as
+`data.decode('utf-8', 'mixed')` or `decode_mixed(data)`.
+"""
+
+import re
+import codecs
+
+#a well formed utf-8 multibyte sequence
+_utf8_char = re.compile(
+    r'[\xc2-\xdf][\x80-\xbf]'
+    r'|\xe0[\xa0-\xbf][\x80-\xbf]'
+    r'|[\xe1-\xef][\x80-\xbf]{2}'
+    r'|\xf0[\x90-\xbf][\x80-\xbf]{2}'
+    r'|[\xf1-\xf3][\x80-\xbf]{3}'
+    r'|\xf4[\x80-\x8f][\x80-\xbf]{2}'
+    )
+#the first two bytes of anything that may be one
+_utf8_start = re.compile(r'[\xc2-\xf4][\x80-\xbf]')
+#bytes looked ahead per call for the next utf-8 sequence
+_window = 256
+
+def mixed_decoder(unicode_error):
+    """
+    Codec error handler decoding the invalid bytes at the error
+    and everything after them up to the next well formed UTF-8
+    sequence as ISO-8859-1, looking at most `_window` bytes ahead.
+    A segment of ISO-8859-1 text takes one call instead of one per
+    run of non ascii bytes. Keeps no state between calls.
+    """
+    if not isinstance(unicode_error, UnicodeDecodeError):
+        raise unicode_error
+    string = unicode_error.object
+    start = unicode_error.start
+    end = unicode_error.end
+    stop = min(end+_window, len(string))
+    m = _utf8_start.search(string, end, stop)
+    while m and not _utf8_char.match(string, m.start()):
+        m = _utf8_start.search(string, m.start()+1, stop)
+    if m:
+        end = m.start()
+    elif stop == len(string):
+        end = stop
+    else:
+        #a sequence may start at the last byte
+        end = stop-1
+    return string[start:end].decode('ISO-8859-1'), end
+
+codecs.register_error('mixed', mixed_decoder)
+
+def decode_mixed(data):
+    """
+    Decode a byte string of UTF-8 with ISO-8859-1 parts.
+    """
+    return data.decode('utf-8', 'mixed')
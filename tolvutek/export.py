@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Streaming export of products to files and loading them back.
+
+Formats are 'jsonl' (JSON Lines), 'csv', 'binary' (fixed schema,
+length prefixed records) and 'parquet' (needs pyarrow). Products
+are written as they come, only parquet buffers a row group.
+Every record holds the `Product` fields that are set and the
+category the product was crawled from.
+"""
+
+import csv
+import json
+import struct
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from tolvutek import Product, TolvutekError
+from tolvutek.index import CatalogIndex
+
+COLUMNS = ('category',)+Product.fields
+INT_COLUMNS = ('discount_price', 'common_price')
+
+EXTENSIONS = {
+    '.jsonl':'jsonl',
+    '.json':'jsonl',
+    '.csv':'csv',
+    '.bin':'binary',
+    '.parquet':'parquet',
+    }
+
+def record(product, category=None):
+    """
+    Get the export record (a dict) of `product`, without hydrating.
+    """
+    fields = product.as_dict()
+    if category is not None:
+        fields['category'] = category
+    return fields
+
+class Writer(object):
+    """
+    Base for the writers, writes records to file object `f`.
+    Closing the writer closes `f` if `own` is set.
+    """
+    def __init__(self, f, own=False):
+        self.f = f
+        self.own = own
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def write(self, product, category=None):
+        self.write_record(record(product, category))
+        self.count += 1
+
+    def write_record(self, fields):
+        raise NotImplementedError
+
+    def close(self):
+        if self.own:
+            self.f.close()
+
+class JsonLinesWriter(Writer):
+    def write_record(self, fields):
+        self.f.write(json.dumps(fields, sort_keys=True)+'\n')
+
+class CsvWriter(Writer):
+    """
+    Unset fields are empty cells. The `detailed` column tells
+    empty strings of detailed products from unset fields.
+    """
+    def __init__(self, f, own=False):
+        super(CsvWriter, self).__init__(f, own)
+        self.csv = csv.writer(f)
+        self.csv.writerow(COLUMNS+('detailed',))
+
+    def write_record(self, fields):
+        row = [
+            unicode(fields.get(c, u'')).encode('utf-8') for c in COLUMNS
+            ]
+        detailed = all(f in fields for f in Product.detail_fields)
+        row.append('1' if detailed else '')
+        self.csv.writerow(row)
+
+class BinaryWriter(Writer):
+    """
+    Each record is its length (uint32), a bitmask of the `COLUMNS`
+    present (uint16) and the present values in `COLUMNS` order,
+    int64 for `INT_COLUMNS` and length prefixed utf-8 for the rest.
+    All little endian.
+    """
+    magic = 'TTEXPORT\x01'
+
+    def __init__(self, f, own=False):
+        super(BinaryWriter, self).__init__(f, own)
+        f.write(self.magic)
+
+    def write_record(self, fields):
+        mask = 0
+        values = []
+        for i, column in enumerate(COLUMNS):
+            if column not in fields:
+                continue
+            mask |= 1 << i
+            value = fields[column]
+            if column in INT_COLUMNS:
+                values.append(struct.pack('<q', value))
+            else:
+                value = unicode(value).encode('utf-8')
+                values.append(struct.pack('<I', len(value)))
+                values.append(value)
+        body = struct.pack('<H', mask)+''.join(values)
+        self.f.write(struct.pack('<I', len(body))+body)
+
+class ParquetWriter(Writer):
+    """
+    Writes row groups of `batch_size` records, unset fields are null.
+    """
+    def __init__(self, f, own=False, batch_size=10000):
+        if pyarrow is None:
+            raise TolvutekError(u'The parquet format needs pyarrow.')
+        super(ParquetWriter, self).__init__(f, own)
+        self.batch_size = batch_size
+        self.schema = pyarrow.schema([
+            (c, pyarrow.int64() if c in INT_COLUMNS else pyarrow.string())
+            for c in COLUMNS
+            ])
+        self.parquet = pyarrow.parquet.ParquetWriter(f, self.schema)
+        self.batch = []
+
+    def write_record(self, fields):
+        self.batch.append(fields)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        arrays = [
+            pyarrow.array([r.get(c) for r in self.batch], self.schema.field(c).type)
+            for c in COLUMNS
+            ]
+        self.parquet.write_table(
+            pyarrow.Table.from_arrays(arrays, schema=self.schema)
+            )
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        self.parquet.close()
+        super(ParquetWriter, self).close()
+
+WRITERS = {
+    'jsonl':JsonLinesWriter,
+    'csv':CsvWriter,
+    'binary':BinaryWriter,
+    'parquet':ParquetWriter,
+    }
+
+def get_format(path, format=None):
+    """
+    Get `format`, or the format for the extension of `path`.
+    """
+    if format is None:
+        for ext, fmt in EXTENSIONS.iteritems():
+            if path.endswith(ext):
+                format = fmt
+    if format not in WRITERS:
+        raise TolvutekError(
+            u'Unknown export format {} for {}.'.format(format, path)
+            )
+    return format
+
+def open_writer(path, format=None):
+    """
+    Get a writer for a new file at `path`, the format is
+    guessed from the extension unless given.
+    """
+    format = get_format(path, format)
+    if format == 'parquet' and pyarrow is None:
+        raise TolvutekError(u'The parquet format needs pyarrow.')
+    return WRITERS[format](open(path, 'wb'), own=True)
+
+def export_products(products, path, format=None, category=None):
+    """
+    Write `products` (any iterable) to `path` under `category`.
+    Returns the number of products written.
+    """
+    with open_writer(path, format) as writer:
+        for product in products:
+            writer.write(product, category)
+    return writer.count
+
+def export_catalog(api, path, paths=None, quick=True, format=None):
+    """
+    Crawl given (cat, subcat, subsubcat) `paths` (default all of
+    `api.category_paths()`) with `api` (a `Tolvutek`) straight into
+    `path`, page by page. The category of each product is its
+    path joined with '/' as in `Tolvutek.index_catalog`.
+    Returns the number of products written.
+    """
+    with open_writer(path, format) as writer:
+        for cpath in paths or api.category_paths():
+            category = u'/'.join(p for p in cpath if p)
+            for product in api.iter_products(*cpath, quick=quick):
+                writer.write(product, category)
+    return writer.count
+
+def read_records(path, format=None):
+    """
+    Yield the records (dicts of the fields set) in export file `path`.
+    """
+    format = get_format(path, format)
+    f = open(path, 'rb')
+    try:
+        for fields in _readers[format](f):
+            yield fields
+    finally:
+        f.close()
+
+def load_products(path, format=None, api=None):
+    """
+    Yield (product, category) for each record in export file `path`.
+    Products get `api` (a `Tolvutek`), without one only the fields
+    that were exported can be read.
+    """
+    for fields in read_records(path, format):
+        category = fields.pop('category', None)
+        yield Product(api=api, **fields), category
+
+def load_index(path, format=None, api=None, index=None):
+    """
+    Load export file `path` into a `CatalogIndex`.
+    """
+    if index is None:
+        index = CatalogIndex()
+    for product, category in load_products(path, format, api):
+        index.add(product, category)
+    return index
+
+def _read_jsonl(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+def _read_csv(f):
+    reader = csv.reader(f)
+    header = next(reader)
+    for row in reader:
+        row = dict(zip(header, row))
+        detailed = row.pop('detailed') == '1'
+        fields = {}
+        for column, value in row.iteritems():
+            if column in INT_COLUMNS:
+                if value:
+                    fields[column] = int(value)
+            elif value or (detailed and column in Product.detail_fields):
+                fields[column] = value.decode('utf-8')
+        yield fields
+
+def _read_binary(f):
+    if f.read(len(BinaryWriter.magic)) != BinaryWriter.magic:
+        raise TolvutekError(u'{} is not a binary export.'.format(f.name))
+    while True:
+        head = f.read(4)
+        if not head:
+            return
+        body = f.read(struct.unpack('<I', head)[0])
+        mask, = struct.unpack_from('<H', body)
+        pos = 2
+        fields = {}
+        for i, column in enumerate(COLUMNS):
+            if not mask & (1 << i):
+                continue
+            if column in INT_COLUMNS:
+                fields[column], = struct.unpack_from('<q', body, pos)
+                pos += 8
+            else:
+                size, = struct.unpack_from('<I', body, pos)
+                pos += 4
+                fields[column] = body[pos:pos+size].decode('utf-8')
+                pos += size
+        yield fields
+
+def _read_parquet(f):
+    if pyarrow is None:
+        raise TolvutekError(u'The parquet format needs pyarrow.')
+    parquet = pyarrow.parquet.ParquetFile(f)
+    for i in xrange(parquet.num_row_groups):
+        columns = parquet.read_row_group(i).to_pydict()
+        for row in zip(*[columns[c] for c in COLUMNS]):
+            yield dict(
+                (c, value) for c, value in zip(COLUMNS, row)
+                if value is not None
+                )
+
+_readers = {
+    'jsonl':_read_jsonl,
+    'csv':_read_csv,
+    'binary':_read_binary,
+    'parquet':_read_parquet,
+    }
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Price history of crawled products in sqlite.
+"""
+
+import time
+import sqlite3
+import threading
+
+from tolvutek.sync import Change
+
+class PriceHistory(object):
+    """
+    Append only price snapshots of products keyed by url,
+    see `record`.
+
+    Prices are stored as runs: a row holds the prices of a product
+    from the snapshot they were first seen in (`since`) to the last
+    snapshot they were seen in unchanged (`until`). A snapshot with
+    the same prices as the last one only moves `until` forward, so
+    identical snapshots add no rows.
+    """
+    price_fields = ('discount_price', 'common_price')
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(
+            'CREATE TABLE IF NOT EXISTS snapshots ('
+            'id INTEGER PRIMARY KEY, taken REAL);'
+            'CREATE TABLE IF NOT EXISTS products ('
+            'id INTEGER PRIMARY KEY, url TEXT UNIQUE, catalog_no TEXT);'
+            'CREATE TABLE IF NOT EXISTS prices ('
+            'product INTEGER, since INTEGER, until INTEGER, '
+            'discount_price INTEGER, common_price INTEGER, '
+            'PRIMARY KEY (product, since));'
+            'CREATE INDEX IF NOT EXISTS prices_until ON prices (until);'
+            )
+        self.db.commit()
+
+    def record(self, products, taken=None):
+        """
+        Record the prices of `products` as a new snapshot taken at
+        `taken` (default now). Products are not hydrated, an unknown
+        common_price keeps the last known one.
+        Returns the snapshot id.
+        """
+        with self.lock:
+            last = self._last_snapshot()
+            snapshot = self.db.execute(
+                'INSERT INTO snapshots (taken) VALUES (?)',
+                (taken if taken is not None else time.time(),)
+                ).lastrowid
+            ids = dict(self.db.execute('SELECT url, id FROM products'))
+            runs = {} #product id:(since, discount_price, common_price)
+            if last is not None:
+                for product, since, discount, common in self.db.execute(
+                    'SELECT product, since, discount_price, common_price '
+                    'FROM prices WHERE until=?', (last,)
+                    ):
+                    runs[product] = (since, discount, common)
+            extend = []
+            insert = []
+            seen = set()
+            for product in products:
+                if product.url in seen:
+                    continue
+                seen.add(product.url)
+                fields = product.as_dict()
+                pid = ids.get(product.url)
+                if pid is None:
+                    pid = ids[product.url] = self.db.execute(
+                        'INSERT INTO products (url, catalog_no) VALUES (?,?)',
+                        (product.url, fields.get('catalog_no'))
+                        ).lastrowid
+                elif 'catalog_no' in fields:
+                    self.db.execute(
+                        'UPDATE products SET catalog_no=? WHERE id=?',
+                        (fields['catalog_no'], pid)
+                        )
+                discount = fields['discount_price']
+                common = fields.get('common_price')
+                run = runs.pop(pid, None)
+                if run is not None:
+                    since, old_discount, old_common = run
+                    if common is None:
+                        common = old_common
+                    if (discount, common) == (old_discount, old_common):
+                        extend.append((snapshot, pid, since))
+                        continue
+                insert.append((pid, snapshot, snapshot, discount, common))
+            self.db.executemany(
+                'UPDATE prices SET until=? WHERE product=? AND since=?', extend
+                )
+            self.db.executemany(
+                'INSERT OR REPLACE INTO prices VALUES (?,?,?,?,?)', insert
+                )
+            self.db.commit()
+        return snapshot
+
+    def snapshots(self):
+        """
+        Get a list of (snapshot id, taken) in order.
+        """
+        with self.lock:
+            return self.db.execute(
+                'SELECT id, taken FROM snapshots ORDER BY id'
+                ).fetchall()
+
+    def snapshot(self, snapshot=None):
+        """
+        Get the prices {url:(discount_price, common_price)}
+        in `snapshot` (default the last one).
+        """
+        with self.lock:
+            if snapshot is None:
+                snapshot = self._last_snapshot()
+            return dict(
+                (url, (discount, common))
+                for url, discount, common in self.db.execute(
+                    'SELECT url, discount_price, common_price '
+                    'FROM prices JOIN products ON products.id=product '
+                    'WHERE since<=? AND until>=?', (snapshot, snapshot)
+                    )
+                )
+
+    def price_drops(self, since=None, field='discount_price'):
+        """
+        Get a `Change` of kind 'price' for every product in the last
+        snapshot with a lower `field` price than in snapshot `since`
+        (default the one before it), biggest drops first.
+        """
+        self._check_field(field)
+        with self.lock:
+            last = self._last_snapshot()
+            if last is None:
+                return []
+            if since is None:
+                since = self.db.execute(
+                    'SELECT MAX(id) FROM snapshots WHERE id<?', (last,)
+                    ).fetchone()[0]
+            rows = self.db.execute(
+                'SELECT url, old.{0}, new.{0} FROM prices new '
+                'JOIN prices old ON old.product=new.product '
+                'AND old.since<=? AND old.until>=? '
+                'JOIN products ON products.id=new.product '
+                'WHERE new.until=? AND new.{0}<old.{0} '
+                'ORDER BY old.{0}-new.{0} DESC, url'.format(field),
+                (since, since, last)
+                ).fetchall()
+        return [
+            Change('price', None, url, None, old, new)
+            for url, old, new in rows
+            ]
+
+    def price_range(self, start=None, end=None, url=None, field='discount_price'):
+        """
+        Get {url:(min price, max price)} of `field` over the snapshots
+        taken between times `start` and `end` (default all of them),
+        optionally only for `url`.
+        """
+        self._check_field(field)
+        with self.lock:
+            first, last = self.db.execute(
+                'SELECT MIN(id), MAX(id) FROM snapshots '
+                'WHERE taken>=? AND taken<=?',
+                (start if start is not None else float('-inf'),
+                 end if end is not None else float('inf'))
+                ).fetchone()
+            if first is None:
+                return {}
+            query = (
+                'SELECT url, MIN({0}), MAX({0}) FROM prices '
+                'JOIN products ON products.id=product '
+                'WHERE since<=? AND until>=? AND {0} IS NOT NULL'
+                ).format(field)
+            args = [last, first]
+            if url is not None:
+                query += ' AND url=?'
+                args.append(url)
+            rows = self.db.execute(query+' GROUP BY product', args)
+            return dict((u, (low, high)) for u, low, high in rows)
+
+    def history(self, url):
+        """
+        Get the price runs of `url` as a list of
+        (first seen, last seen, discount_price, common_price),
+        the times being when the snapshots were taken.
+        """
+        with self.lock:
+            return self.db.execute(
+                'SELECT s1.taken, s2.taken, discount_price, common_price '
+                'FROM prices JOIN products ON products.id=product '
+                'JOIN snapshots s1 ON s1.id=since '
+                'JOIN snapshots s2 ON s2.id=until '
+                'WHERE url=? ORDER BY since', (url,)
+                ).fetchall()
+
+    def close(self):
+        self.db.close()
+
+    def _last_snapshot(self):
+        return self.db.execute('SELECT MAX(id) FROM snapshots').fetchone()[0]
+
+    def _check_field(self, field):
+        if field not in self.price_fields:
+            raise ValueError(u'Not a price field: {}'.format(field))
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Columnar price index over crawled products.
+Uses numpy for the queries when it is installed.
+"""
+
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#common_price of products that have not been hydrated
+UNKNOWN = -1
+
+class CatalogIndex(object):
+    """
+    Products in rows with array backed price and category columns.
+    A product url is only indexed once, adding it again
+    updates its row.
+    """
+    price_fields = ('discount_price', 'common_price')
+
+    def __init__(self):
+        self.products = [] #row:Product
+        self.rows = {} #url:row
+        self.categories = [] #category id:category name
+        self.category_ids = {} #category name:category id
+        self.columns = {
+            'discount_price':array('l'),
+            'common_price':array('l'),
+            'category':array('l'),
+            }
+        self._arrays = {} #field:numpy copy of column
+        self._sorted = {} #field:(row order, sorted values), no numpy
+
+    @classmethod
+    def from_products(cls, products, category=None):
+        index = cls()
+        index.extend(products, category)
+        return index
+
+    def __len__(self):
+        return len(self.products)
+
+    def add(self, product, category=None):
+        """
+        Add or update `product` under `category` (any hashable name).
+        Products are not hydrated, common_price is `UNKNOWN`
+        for products that are not detailed.
+        """
+        fields = product.as_dict()
+        values = {
+            'discount_price':fields['discount_price'],
+            'common_price':fields.get('common_price', UNKNOWN),
+            'category':self.category_id(category),
+            }
+        row = self.rows.get(product.url)
+        if row is None:
+            self.rows[product.url] = len(self.products)
+            self.products.append(product)
+            for field, value in values.iteritems():
+                self.columns[field].append(value)
+        else:
+            self.products[row] = product
+            for field, value in values.iteritems():
+                self.columns[field][row] = value
+        self._arrays.clear()
+        self._sorted.clear()
+
+    def extend(self, products, category=None):
+        for product in products:
+            self.add(product, category)
+
+    def category_id(self, category):
+        try:
+            return self.category_ids[category]
+        except KeyError:
+            self.category_ids[category] = len(self.categories)
+            self.categories.append(category)
+            return self.category_ids[category]
+
+    def category_of(self, product):
+        """
+        Get the category `product` was indexed under.
+        """
+        return self.categories[self.columns['category'][self.rows[product.url]]]
+
+    def column(self, field):
+        """
+        Get column `field` as a numpy array if numpy is installed, 
+        otherwise the underlying `array`. 
+        The numpy array is cached until the next `add`.
+        """
+        col = self.columns[field]
+        if numpy is None:
+            return col
+        try:
+            return self._arrays[field]
+        except KeyError:
+            #copied, the array may be reallocated by later adds
+            arr = numpy.frombuffer(col, dtype=col.typecode).copy() \
+                if col else numpy.zeros(0, dtype=col.typecode)
+            self._arrays[field] = arr
+            return arr
+
+    def range(self, low=None, high=None, field='discount_price', category=None):
+        """
+        Get products with `low` <= `field` <= `high`, sorted by `field`.
+        Either bound can be None. Products with an `UNKNOWN`
+        price are left out.
+        """
+        if numpy is not None:
+            col = self.column(field)
+            mask = col != UNKNOWN
+            if low is not None:
+                mask &= col >= low
+            if high is not None:
+                mask &= col <= high
+            if category is not None:
+                mask &= self.column('category') == self._cid(category)
+            rows = numpy.flatnonzero(mask)
+            rows = rows[numpy.argsort(col[rows], kind='mergesort')]
+        else:
+            order, values = self._sorted_column(field)
+            start = bisect_right(values, UNKNOWN)
+            if low is not None:
+                start = max(start, bisect_left(values, low))
+            end = len(values) if high is None else bisect_right(values, high)
+            rows = order[start:end]
+            if category is not None:
+                cid = self._cid(category)
+                cats = self.columns['category']
+                rows = [row for row in rows if cats[row] == cid]
+        return [self.products[row] for row in rows]
+
+    def cheapest(self, k, field='discount_price', category=None):
+        """
+        Get the `k` products with the lowest known `field`, sorted.
+        """
+        if numpy is not None:
+            col = self.column(field)
+            mask = col != UNKNOWN
+            if category is not None:
+                mask &= self.column('category') == self._cid(category)
+            rows = numpy.flatnonzero(mask)
+            #stable so ties come in row order like heapq.nsmallest
+            rows = rows[numpy.argsort(col[rows], kind='mergesort')[:k]]
+        else:
+            col = self.columns[field]
+            cats = self.columns['category']
+            cid = None if category is None else self._cid(category)
+            rows = (
+                row for row in xrange(len(col)) if col[row] != UNKNOWN
+                and (cid is None or cats[row] == cid)
+                )
+            rows = heapq.nsmallest(k, rows, key=col.__getitem__)
+        return [self.products[row] for row in rows]
+
+    def cheapest_per_category(self, k, field='discount_price'):
+        """
+        Get a dict {category:[k cheapest products]}.
+        """
+        return dict(
+            (category, self.cheapest(k, field, category))
+            for category in self.categories
+            )
+
+    def discount_ratios(self):
+        """
+        Get 1-discount_price/common_price for every row as a float
+        column, nan where common_price is `UNKNOWN` or 0.
+        """
+        if numpy is not None:
+            common = self.column('common_price').astype(float)
+            discount = self.column('discount_price')
+            common[common <= 0] = numpy.nan
+            return 1-discount/common
+        ratios = array('d')
+        for discount, common in zip(
+            self.columns['discount_price'], self.columns['common_price']):
+            if common > 0:
+                ratios.append(1-float(discount)/common)
+            else:
+                ratios.append(float('nan'))
+        return ratios
+
+    def best_discounts(self, k):
+        """
+        Get the `k` products with the highest discount ratio.
+        """
+        ratios = self.discount_ratios()
+        if numpy is not None:
+            rows = numpy.flatnonzero(~numpy.isnan(ratios))
+            rows = rows[numpy.argsort(-ratios[rows], kind='mergesort')[:k]]
+        else:
+            rows = (row for row, r in enumerate(ratios) if r == r)
+            rows = heapq.nlargest(k, rows, key=ratios.__getitem__)
+        return [self.products[row] for row in rows]
+
+    def _cid(self, category):
+        #unknown categories match nothing
+        return self.category_ids.get(category, -1)
+
+    def _sorted_column(self, field):
+        """
+        Get (row order, sorted values) of `field`, cached until
+        the next `add`.
+        """
+        try:
+            return self._sorted[field]
+        except KeyError:
+            col = self.columns[field]
+            order = sorted(xrange(len(col)), key=col.__getitem__)
+            values = array(col.typecode, (col[row] for row in order))
+            self._sorted[field] = (order, values)
+            return self._sorted[field]
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Rate limiting and retries for requests.
+"""
+
+import time
+import random
+import socket
+import httplib
+import logging
+import threading
+from urlparse import urlparse
+from urllib2 import HTTPError, URLError
+
+log = logging.getLogger('tolvutek')
+
+class TokenBucket(object):
+    """
+    Allows `rate` acquisitions per second with bursts of `burst`.
+    """
+    def __init__(self, rate, burst=None, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = burst if burst is not None else max(1, rate)
+        self.tokens = self.burst
+        self.clock = clock
+        self.sleep = sleep
+        self.last = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, blocking until one is available.
+        Returns the number of seconds waited.
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(
+                self.burst, self.tokens+(now-self.last)*self.rate
+                )
+            self.last = now
+            self.tokens -= 1
+            wait = -self.tokens/self.rate if self.tokens < 0 else 0
+        if wait:
+            self.sleep(wait)
+        return wait
+
+class Scheduler(object):
+    """
+    Runs requests with an optional token bucket rate limit
+    (`rate` requests per second, `burst`), at most `per_host`
+    concurrent requests per host and up to `retries` retries with
+    jittered exponential backoff on 5xx responses, timeouts and
+    connection errors.
+
+    Counts requests, throttled (delayed by the rate limit),
+    retried and failed requests, see `stats()`. A 304 (not 
+    modified) is not a failure.
+    """
+    #codes that mean the request was not processed, safe to retry posts
+    unprocessed_codes = (429, 502, 503, 504)
+
+    def __init__(
+        self, rate=None, burst=None, per_host=None, retries=3,
+        backoff=0.5, max_backoff=30, sleep=time.sleep
+        ):
+        self.bucket = TokenBucket(rate, burst, sleep=sleep) if rate else None
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.hosts = {} #host:BoundedSemaphore
+        self.requests = 0
+        self.throttled = 0
+        self.retried = 0
+        self.failed = 0
+
+    def call(self, url, func, idempotent=True):
+        """
+        Run `func` (doing a request to `url`) under the limits,
+        retrying it when it fails with a transient error.
+        Non `idempotent` requests are only retried when the server
+        says it didn't process them.
+        """
+        semaphore = self._host_semaphore(urlparse(url).netloc)
+        attempt = 0
+        while True:
+            if semaphore:
+                semaphore.acquire()
+            try:
+                if self.bucket and self.bucket.acquire():
+                    self._count('throttled')
+                self._count('requests')
+                return func()
+            except Exception as e:
+                if isinstance(e, HTTPError) and e.code == 304:
+                    #not modified answers a conditional request
+                    raise
+                if attempt >= self.retries or not self.retryable(e, idempotent):
+                    self._count('failed')
+                    raise
+            finally:
+                if semaphore:
+                    semaphore.release()
+            attempt += 1
+            self._count('retried')
+            delay = random.uniform(
+                0, min(self.max_backoff, self.backoff*2**(attempt-1))
+                )
+            log.debug(
+                u'retry %d of %s in %.2fs: %r', attempt, url, delay, e
+                )
+            self.sleep(delay)
+
+    def retryable(self, error, idempotent=True):
+        """
+        Check whether `error` is a transient failure worth a retry.
+        """
+        if isinstance(error, HTTPError):
+            if idempotent:
+                return error.code >= 500 or error.code == 429
+            return error.code in self.unprocessed_codes
+        if not idempotent:
+            return False
+        if isinstance(error, URLError):
+            return isinstance(error.reason, (socket.error, httplib.HTTPException))
+        return isinstance(error, (socket.error, httplib.HTTPException))
+
+    def stats(self):
+        """
+        Get a dict of the request counters.
+        """
+        return {
+            'requests':self.requests,
+            'throttled':self.throttled,
+            'retried':self.retried,
+            'failed':self.failed
+            }
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter)+1)
+
+    def _host_semaphore(self, host):
+        if not self.per_host:
+            return None
+        with self.lock:
+            try:
+                return self.hosts[host]
+            except KeyError:
+                self.hosts[host] = threading.BoundedSemaphore(self.per_host)
+                return self.hosts[host]
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Spec extraction from product names and descriptions and an
+inverted index over the extracted specs.
+"""
+
+import re
+import threading
+
+#capacity in GB, kits like 2x8GB count in full.
+#not interface speeds like 6Gb/s
+_capacity = re.compile(
+    r'(?<![x\d.,])(?:(\d+)\s?x\s?)?(\d+(?:[.,]\d+)?)\s?(GB|TB)\b(?!/s)',
+    re.IGNORECASE
+    )
+_ram = re.compile(r'\b(DDR\d?)', re.IGNORECASE)
+_socket = re.compile(
+    r'\b(?:(LGA|socket)\s?(\d{3,4})|(AM\d\+?|FM\d\+?))(?!\w)', re.IGNORECASE
+    )
+_interface = re.compile(
+    r'\b(SATA\s?(?:III|II|3|2|6\s?Gb/s|3\s?Gb/s)?|NVMe|M\.2|PCIe|IDE)(?!\w)',
+    re.IGNORECASE
+    )
+_kind = re.compile(r'\b(SSD|HDD)\b', re.IGNORECASE)
+
+_interfaces = {
+    'sataiii':'sata3', 'sata6gb/s':'sata3',
+    'sataii':'sata2', 'sata3gb/s':'sata2',
+    }
+
+def parse_capacity(text):
+    """
+    Get capacity in GB from text like '8', '120GB', '2x8GB' or '1TB'.
+    1TB is 1000GB like drives are sold. None if not a capacity.
+    """
+    text = text.strip()
+    if text.isdigit():
+        return int(text)
+    m = _capacity.search(text)
+    if not m:
+        return None
+    size = float(m.group(2).replace(',', '.'))*int(m.group(1) or 1)
+    if m.group(3).upper() == 'TB':
+        size *= 1000
+    return int(size)
+
+def extract_specs(*texts):
+    """
+    Extract specs from given texts, e.g. a product name and
+    description. The first text a spec is found in wins.
+    Returns a dict with any of the keys
+    'capacity' (GB), 'module' (GB per module of a kit like 2x8GB),
+    'ram', 'socket', 'interface' and 'kind', values are lower case.
+    """
+    specs = {}
+    for text in texts:
+        if not text:
+            continue
+        if 'capacity' not in specs:
+            m = _capacity.search(text)
+            capacity = parse_capacity(text) if m else None
+            if capacity:
+                specs['capacity'] = capacity
+                if m.group(1):
+                    specs['module'] = capacity/int(m.group(1))
+        if 'ram' not in specs:
+            m = _ram.search(text)
+            if m:
+                specs['ram'] = m.group(1).lower()
+        if 'socket' not in specs:
+            m = _socket.search(text)
+            if m:
+                if m.group(2):
+                    specs['socket'] = 'lga'+m.group(2)
+                else:
+                    specs['socket'] = m.group(3).lower()
+        if 'interface' not in specs:
+            m = _interface.search(text)
+            if m:
+                interface = re.sub(r'\s', '', m.group(1).lower())
+                specs['interface'] = _interfaces.get(interface, interface)
+        if 'kind' not in specs:
+            m = _kind.search(text)
+            if m:
+                specs['kind'] = m.group(1).lower()
+    return specs
+
+class SpecIndex(object):
+    """
+    Inverted index {(spec, value):set(urls)}.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = {} #(spec, value):set(urls)
+        self.specs = {} #url:specs
+
+    def add(self, url, specs):
+        """
+        Index `specs` of product at `url`, replacing earlier specs.
+        """
+        with self.lock:
+            for item in self.specs.pop(url, {}).iteritems():
+                self.postings[item].discard(url)
+                if not self.postings[item]:
+                    del self.postings[item]
+            self.specs[url] = specs
+            for item in specs.iteritems():
+                self.postings.setdefault(item, set()).add(url)
+
+    def remove(self, url):
+        """
+        Drop the specs of product at `url` from the index.
+        """
+        with self.lock:
+            for item in self.specs.pop(url, {}).iteritems():
+                postings = self.postings[item]
+                postings.discard(url)
+                if not postings:
+                    del self.postings[item]
+
+    def __contains__(self, url):
+        return url in self.specs
+
+    def __len__(self):
+        return len(self.specs)
+
+    def lookup(self, **specs):
+        """
+        Get the set of urls having all given specs,
+        e.g. lookup(capacity=16, ram='ddr4').
+        """
+        with self.lock:
+            urls = None
+            for item in specs.iteritems():
+                found = self.postings.get(item, set())
+                urls = set(found) if urls is None else urls & found
+                if not urls:
+                    break
+            return urls or set()
+
+    def query(self, text):
+        """
+        Get urls matching the specs in a query like '16GB DDR4' or '1TB SSD'.
+        """
+        specs = extract_specs(text)
+        if not specs:
+            return set()
+        return self.lookup(**specs)
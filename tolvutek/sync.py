@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Change detection for `Tolvutek.sync_catalog`.
+"""
+
+import hashlib
+from collections import namedtuple
+
+#kind is one of 'added', 'removed' or 'price'
+Change = namedtuple(
+    'Change', 'kind category url product old_price new_price'
+    )
+
+def fingerprint(entries):
+    """
+    Get a fingerprint of a listing page from its
+    (url, name, discount_price) entries.
+    """
+    h = hashlib.sha1()
+    for url, name, price in sorted(entries):
+        h.update(u'{}\t{}\t{}\n'.format(url, name, price).encode('utf-8'))
+    return h.hexdigest()
+
+def diff_entries(old, new):
+    """
+    Compare two {url:(name, discount_price)} listings.
+    Returns (added, removed, changed) lists of urls, `changed`
+    being the ones with a different discount_price.
+    """
+    added = [url for url in new if url not in old]
+    removed = [url for url in old if url not in new]
+    changed = [
+        url for url in new if url in old and old[url][1] != new[url][1]
+        ]
+    return added, removed, changed
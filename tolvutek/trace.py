@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Request tracing for `Tolvutek`.
+
+Work is timed in spans named after the phase:
+'fetch', 'decode', 'parse' and 'extract', plus zero length
+'soup_cache' events for soup cache hits and 'coalesced' events
+for calls that waited for the same fetch in another thread.
+Finished spans are passed to the sinks of the `Tracer`.
+"""
+
+import json
+import time
+import cProfile
+import threading
+
+class Span(object):
+    __slots__ = ('tracer', 'name', 'url', 'attrs', 'start', 'duration', 'thread')
+
+    def __init__(self, tracer, name, url=None, attrs=None):
+        self.tracer = tracer
+        self.name = name
+        self.url = url
+        self.attrs = attrs or {}
+        self.start = time.time()
+        self.duration = 0.0
+        self.thread = threading.current_thread().name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.duration = time.time()-self.start
+        if type is not None:
+            self.attrs['error'] = repr(value)
+        self.tracer.emit(self)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def as_dict(self):
+        d = {
+            'name':self.name,
+            'url':self.url,
+            'start':self.start,
+            'duration':self.duration,
+            'thread':self.thread
+            }
+        d.update(self.attrs)
+        return d
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def set(self, **attrs):
+        pass
+
+class NullTracer(object):
+    """
+    Tracer that does nothing, the default.
+    """
+    enabled = False
+    _span = _NullSpan()
+
+    def span(self, name, url=None, **attrs):
+        return self._span
+
+    def event(self, name, url=None, **attrs):
+        pass
+
+class Tracer(object):
+    """
+    Times spans and passes them to each of `sinks`,
+    callables taking a `Span`.
+    """
+    enabled = True
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+
+    def span(self, name, url=None, **attrs):
+        """
+        Get a context manager timing its block as a span.
+        """
+        return Span(self, name, url, attrs)
+
+    def event(self, name, url=None, **attrs):
+        """
+        Emit a zero length span.
+        """
+        self.emit(Span(self, name, url, attrs))
+
+    def emit(self, span):
+        for sink in self.sinks:
+            sink(span)
+
+class StatsSink(object):
+    """
+    Keeps count, total time, bytes and errors per span name
+    in memory, see `summary()`.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def __call__(self, span):
+        with self.lock:
+            stats = self.stats.setdefault(
+                span.name, {'count':0, 'time':0.0, 'bytes':0, 'errors':0}
+                )
+            stats['count'] += 1
+            stats['time'] += span.duration
+            stats['bytes'] += span.attrs.get('bytes', 0)
+            if 'error' in span.attrs:
+                stats['errors'] += 1
+
+    def summary(self):
+        """
+        Get a copy of the stats {name:{'count', 'time', 'bytes', 'errors'}}.
+        """
+        with self.lock:
+            return dict((k, dict(v)) for k, v in self.stats.iteritems())
+
+class JsonLinesSink(object):
+    """
+    Writes each span as a json line to file object `f`.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.lock = threading.Lock()
+
+    def __call__(self, span):
+        line = json.dumps(span.as_dict())+'\n'
+        with self.lock:
+            self.f.write(line)
+
+class Profiler(object):
+    """
+    Context manager profiling its block with cProfile,
+    dumping stats to `path` when given. Only the thread that
+    enters it is profiled.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        self.profile.enable()
+        return self.profile
+
+    def __exit__(self, type, value, traceback):
+        self.profile.disable()
+        if self.path:
+            self.profile.dump_stats(self.path)
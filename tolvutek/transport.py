@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+#encoding:utf-8
+
+# This file is part of tolvutekapi.
+# Copyright 2013, Steinthor Palsson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""
+Keep-alive http transport with a connection pool per host.
+Drop in replacement for the urllib2 opener `Tolvutek` uses.
+"""
+
+import zlib
+import errno
+import socket
+import httplib
+import logging
+import threading
+from urlparse import urljoin
+from StringIO import StringIO
+from cookielib import CookieJar
+from urllib2 import Request, HTTPError, URLError, __version__
+
+log = logging.getLogger('tolvutek')
+
+class Response(object):
+    """
+    Fully read http response, quacks like the urllib2 response.
+    """
+    def __init__(self, url, code, msg, headers, body):
+        self.url = url
+        self.code = code
+        self.msg = msg
+        self.headers = headers
+        self.body = body
+
+    def read(self):
+        return self.body
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+class Transport(object):
+    """
+    Opens urls over pooled persistent connections.
+    Asks for gzip and decompresses transparently. Cookies are
+    handled with `cookiejar` and redirects are followed like
+    urllib2 does. Non 2xx responses raise `urllib2.HTTPError`.
+
+    At most `maxsize` idle connections are kept per host.
+    """
+    connection_classes = {
+        'http':httplib.HTTPConnection,
+        'https':httplib.HTTPSConnection
+        }
+    redirect_codes = (301, 302, 303, 307)
+
+    def __init__(self, cookiejar=None, timeout=30, maxsize=4, max_redirects=10):
+        self.cookiejar = CookieJar() if cookiejar is None else cookiejar
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self.max_redirects = max_redirects
+        self.lock = threading.Lock()
+        self.pools = {} #(scheme, host):[idle connections]
+
+    def open(self, request, data=None):
+        """
+        Open `request` (a url or `urllib2.Request`) and get a `Response`.
+        `data` makes it a POST.
+        """
+        if isinstance(request, basestring):
+            request = Request(request)
+        if data is not None:
+            request.add_data(data)
+        for i in xrange(self.max_redirects+1):
+            response = self._send(request)
+            location = response.headers.getheader('Location')
+            if response.code in self.redirect_codes and location:
+                url = urljoin(request.get_full_url(), location)
+                log.debug(u'redirect %s -> %s', request.get_full_url(), url)
+                request = Request(url)
+                continue
+            if not 200 <= response.code < 300:
+                raise HTTPError(
+                    response.url, response.code, response.msg,
+                    response.headers, StringIO(response.body)
+                    )
+            return response
+        raise HTTPError(
+            response.url, response.code, 'Too many redirects',
+            response.headers, StringIO(response.body)
+            )
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self.lock:
+            pools, self.pools = self.pools, {}
+        for conns in pools.itervalues():
+            for conn in conns:
+                conn.close()
+
+    def _send(self, request):
+        key = (request.get_type(), request.get_host())
+        self.cookiejar.add_cookie_header(request)
+        headers = {'User-Agent':'Python-urllib/{}'.format(__version__)}
+        headers.update(request.header_items())
+        headers['Accept-Encoding'] = 'gzip'
+        headers['Connection'] = 'keep-alive'
+        if request.has_data():
+            headers.setdefault(
+                'Content-Type', 'application/x-www-form-urlencoded'
+                )
+        conn, reused = self._get_conn(key)
+        try:
+            resp, body = self._request(conn, request, headers)
+        except (httplib.HTTPException, socket.error) as e:
+            conn.close()
+            if not (reused and self._stale(e, request)):
+                raise URLError(e)
+            #the server dropped an idle connection, try a new one
+            conn = self.connection_classes[key[0]](key[1], timeout=self.timeout)
+            try:
+                resp, body = self._request(conn, request, headers)
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                raise URLError(e)
+        if resp.will_close:
+            conn.close()
+        else:
+            self._put_conn(key, conn)
+        if resp.getheader('Content-Encoding', '').lower() == 'gzip':
+            body = zlib.decompress(body, 16+zlib.MAX_WBITS)
+        response = Response(
+            request.get_full_url(), resp.status, resp.reason, resp.msg, body
+            )
+        self.cookiejar.extract_cookies(response, request)
+        return response
+
+    def _request(self, conn, request, headers):
+        conn.request(
+            request.get_method(), request.get_selector(),
+            request.get_data(), headers
+            )
+        resp = conn.getresponse()
+        try:
+            return resp, resp.read()
+        except (httplib.HTTPException, socket.error) as e:
+            #the server has answered, never send the request again
+            e.responded = True
+            raise
+
+    def _stale(self, error, request):
+        """
+        Check whether `error` on a reused connection means the server 
+        closed it before processing `request`, so that sending it again 
+        is safe. Requests with data and timeouts are never retried, the 
+        server may have acted on them.
+        """
+        if request.has_data() or getattr(error, 'responded', False):
+            return False
+        if isinstance(error, httplib.BadStatusLine):
+            return True
+        if isinstance(error, socket.timeout):
+            return False
+        return isinstance(error, socket.error) and error.errno in (
+            errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED
+            )
+
+    def _get_conn(self, key):
+        """
+        Get a (connection, reused) tuple for (scheme, host) `key`.
+        """
+        with self.lock:
+            idle = self.pools.get(key)
+            if idle:
+                return idle.pop(), True
+        try:
+            cls = self.connection_classes[key[0]]
+        except KeyError:
+            raise URLError(u'unknown url type: {}'.format(key[0]))
+        return cls(key[1], timeout=self.timeout), False
+
+    def _put_conn(self, key, conn):
+        with self.lock:
+            idle = self.pools.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()